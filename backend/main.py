@@ -33,6 +33,7 @@ class PredictionResult(BaseModel):
     ligand_smiles: str
     model1_result: dict
     model2_result: dict
+    model3_result: dict
     status: str
 
 
@@ -57,8 +58,11 @@ async def get_predictions(request: PredictionRequest):
                 model2_task = asyncio.create_task(
                     call_model("http://modelo2:5002/get_prediction", payload)
                  )
+                model3_task = asyncio.create_task(
+                    call_model("http://modelo3:5003/get_prediction", payload)
+                 )
                 
-                model1_result, model2_result = await asyncio.gather(model1_task, model2_task)
+                model1_result, model2_result, model3_result = await asyncio.gather(model1_task, model2_task, model3_task)
 
 
                 
@@ -67,6 +71,7 @@ async def get_predictions(request: PredictionRequest):
                     "ligand_smiles": pair.ligand_smiles,
                     "model1_result": model1_result,
                     "model2_result": model2_result,
+                    "model3_result": model3_result,
                     "status": "success"
                 }
                 results.append(result)
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from model1 import mol_to_graph_arrays
+
+# ==============================================================
+# --- Parallel RDKit featurization for batch requests
+# ==============================================================
+# Los workers devuelven arrays numpy compactos (x float32, edge_index int64)
+# en lugar de objetos Data de PyG: se serializan mucho más rápido entre procesos
+# y el Batch se monta en el proceso principal.
+
+FEATURIZE_WORKERS = int(os.environ.get("MODELO1_FEATURIZE_WORKERS", os.cpu_count() or 1))
+FEATURIZE_CHUNK_SIZE = int(os.environ.get("MODELO1_FEATURIZE_CHUNK_SIZE", 32))
+# Por debajo de este número de SMILES únicos no compensa el coste de IPC.
+FEATURIZE_MIN_PARALLEL = int(os.environ.get("MODELO1_FEATURIZE_MIN_PARALLEL", 64))
+
+
+def _featurize_chunk(smiles_chunk):
+    """Featurize a chunk of SMILES. Returns one (x, edge_index, error) tuple per SMILES."""
+    out = []
+    for smiles in smiles_chunk:
+        try:
+            x, edge_index = mol_to_graph_arrays(smiles)
+            out.append((x, edge_index, None))
+        except Exception as e:
+            out.append((None, None, str(e)))
+    return out
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class FeaturizerPool:
+    """
+    Process pool that featurizes ligands in chunks.
+    :param workers: Number of worker processes (<= 1 disables the pool).
+    :param chunk_size: Number of SMILES sent to a worker per task.
+    """
+    def __init__(self, workers=FEATURIZE_WORKERS, chunk_size=FEATURIZE_CHUNK_SIZE,
+                 min_parallel=FEATURIZE_MIN_PARALLEL):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def featurize(self, smiles_list):
+        """
+        Featurize a list of SMILES, deduplicating repeated ligands.
+        :return: dict smiles -> (x, edge_index, error). Invalid SMILES have x=None and an error message.
+        """
+        unique = list(dict.fromkeys(smiles_list))
+        if self.executor is None or len(unique) < self.min_parallel:
+            results = _featurize_chunk(unique)
+        else:
+            results = []
+            for chunk_result in self.executor.map(_featurize_chunk, _chunks(unique, self.chunk_size)):
+                results.extend(chunk_result)
+        return dict(zip(unique, results))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -34,17 +34,9 @@ class GNNNet(torch.nn.Module):
         self.fc2 = nn.Linear(1024, 512)
         self.out = nn.Linear(512, self.n_output)
 
-    def forward(self, data_mol, data_pro):
-        # get graph input
+    def ligand_conv(self, data_mol):
+        """GCN encoder of the ligand graph followed by mean pooling."""
         mol_x, mol_edge_index, mol_batch = data_mol.x, data_mol.edge_index, data_mol.batch
-        # get protein input
-        target_x, target_edge_index, target_batch = data_pro.x, data_pro.edge_index, data_pro.batch
-
-        # target_seq=data_pro.target
-
-        # print('size')
-        # print('mol_x', mol_x.size(), 'edge_index', mol_edge_index.size(), 'batch', mol_batch.size())
-        # print('target_x', target_x.size(), 'target_edge_index', target_batch.size(), 'batch', target_batch.size())
 
         x = self.mol_conv1(mol_x, mol_edge_index)
         x = self.relu(x)
@@ -57,12 +49,11 @@ class GNNNet(torch.nn.Module):
         x = self.mol_conv3(x, mol_edge_index)
         x = self.relu(x)
         x = gep(x, mol_batch)  # global pooling
+        return x
 
-        # flatten
-        x = self.relu(self.mol_fc_g1(x))
-        x = self.dropout(x)
-        x = self.mol_fc_g2(x)
-        x = self.dropout(x)
+    def protein_conv_layers(self, data_pro):
+        """Per-residue activations of the protein GCN encoder (before pooling)."""
+        target_x, target_edge_index = data_pro.x, data_pro.edge_index
 
         xt = self.pro_conv1(target_x, target_edge_index)
         xt = self.relu(xt)
@@ -77,17 +68,31 @@ class GNNNet(torch.nn.Module):
 
         # xt = self.pro_conv4(xt, target_edge_index)
         # xt = self.relu(xt)
-        xt = gep(xt, target_batch)  # global pooling
+        return xt
+
+    def protein_conv(self, data_pro):
+        """GCN encoder of the protein graph followed by mean pooling."""
+        return gep(self.protein_conv_layers(data_pro), data_pro.batch)  # global pooling
 
+    def ligand_fc(self, x):
+        # flatten
+        x = self.relu(self.mol_fc_g1(x))
+        x = self.dropout(x)
+        x = self.mol_fc_g2(x)
+        x = self.dropout(x)
+        return x
+
+    def protein_fc(self, xt):
         # flatten
         xt = self.relu(self.pro_fc_g1(xt))
         xt = self.dropout(xt)
         xt = self.pro_fc_g2(xt)
         xt = self.dropout(xt)
+        return xt
 
-        # print(x.size(), xt.size())
+    def combine(self, x, xt):
         # concat
-        xc = torch.cat((x, xt), 1)
+        xc = torch.cat((x, xt), -1)
         # add some dense layers
         xc = self.fc1(xc)
         xc = self.relu(xc)
@@ -97,3 +102,8 @@ class GNNNet(torch.nn.Module):
         xc = self.dropout(xc)
         out = self.out(xc)
         return out
+
+    def forward(self, data_mol, data_pro):
+        x = self.ligand_fc(self.ligand_conv(data_mol))
+        xt = self.protein_fc(self.protein_conv(data_pro))
+        return self.combine(x, xt)
@@ -1,30 +1,58 @@
 from model1 import *
 import torch
-from torch_geometric.data import Data
+from torch_geometric.data import Data, Batch
 from rdkit import Chem
 import numpy as np
 import networkx as nx
 
 from gnn import GNNNet  
+from featurize import FeaturizerPool
+from mutscan import MutationalScanner, enumerate_mutations, benchmark
+from uncertainty import mc_dropout_predict
 import warnings
 warnings.filterwarnings("ignore")
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, conint, confloat, conlist
 from contextlib import asynccontextmanager
+from typing import List, Optional
+import os
 import time
 
 model: GNNNet = None
 model_load_failed = False
+featurizer: FeaturizerPool = None
+
+BATCH_SIZE = int(os.environ.get("MODELO1_BATCH_SIZE", 128))
+# MC dropout samples run in chunks of MODELO1_MC_CHUNK; T only bounds the time of a request
+MAX_MC_SAMPLES = int(os.environ.get("MODELO1_MAX_MC_SAMPLES", 1000))
+# each mutant of the scan benchmark is a full-model forward
+MAX_SCAN_BENCHMARK = int(os.environ.get("MODELO1_MAX_SCAN_BENCHMARK", 50))
 
 
 class PredictionRequest(BaseModel):
     protein_sequence: str 
     ligand_smiles: str 
 
+
+class BatchPredictionRequest(BaseModel):
+    data: List[PredictionRequest]
+
+
+class UncertaintyRequest(BatchPredictionRequest):
+    n_samples: conint(ge=2, le=MAX_MC_SAMPLES) = 50    # std needs at least two samples
+    quantiles: conlist(confloat(ge=0, le=1), min_length=1) = [0.05, 0.5, 0.95]
+
+
+class MutationalScanRequest(BaseModel):
+    protein_sequence: str
+    ligand_smiles: str
+    positions: Optional[List[int]] = None   # 0-based; None = every residue
+    benchmark: conint(ge=0, le=MAX_SCAN_BENCHMARK) = 0    # mutants checked against full recomputation
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global model, model_load_failed
+    global model, model_load_failed, featurizer
     start_time = time.time()
     
     try:
@@ -36,7 +64,9 @@ async def lifespan(app: FastAPI):
         end_time = time.time()
         print(f"Error CRÍTICO al inicializar el modelo1 después de {end_time - start_time:.2f} segundos: {e}")
         model_load_failed = True
+    featurizer = FeaturizerPool()
     yield
+    featurizer.shutdown()
     model.clear()
 
 app = FastAPI(
@@ -83,3 +113,104 @@ async def get_prediction(data: PredictionRequest):
     print("IC50 approx (pM):", float(ic50_simple*1e12))
     print("IC50 (pM) with factor", factor, ":", float(ic50_cp*1e12)) 
 
+
+def prepare_rows(pairs):
+    """
+    Featurize the pairs of a batch request. Invalid rows get an error result instead of failing the batch.
+    :return results: Per-row results, None for rows still to be predicted.
+    :return batches: Generator of (rows, mol_batch, pro_batch) with at most BATCH_SIZE rows each.
+    """
+    device = next(model.parameters()).device
+    ligands = featurizer.featurize([pair.ligand_smiles for pair in pairs])
+    proteins = {}
+
+    results = [None] * len(pairs)
+    valid_rows = []
+    for i, pair in enumerate(pairs):
+        x, edge_index, error = ligands[pair.ligand_smiles]
+        if error is None and pair.protein_sequence not in proteins:
+            try:
+                proteins[pair.protein_sequence] = seq_feature(pair.protein_sequence)
+            except Exception as e:
+                error = f"Invalid protein sequence: {e}"
+        if error is not None:
+            results[i] = {"status": "error", "error": error}
+        else:
+            valid_rows.append(i)
+
+    def batches():
+        for start in range(0, len(valid_rows), BATCH_SIZE):
+            rows = valid_rows[start:start + BATCH_SIZE]
+            mol_batch = Batch.from_data_list(
+                [arrays_to_graph(*ligands[pairs[i].ligand_smiles][:2]) for i in rows]).to(device)
+            pro_batch = Batch.from_data_list(
+                [proteins[pairs[i].protein_sequence] for i in rows]).to(device)
+            yield rows, mol_batch, pro_batch
+
+    return results, batches()
+
+
+def check_model():
+    if model is None or model_load_failed:
+        raise HTTPException(status_code=503, detail="Servicio no disponible. El modelo1 no se cargó correctamente al inicio.")
+
+
+@app.post("/get_predictions", status_code=200)
+def get_predictions(data: BatchPredictionRequest):
+    """
+    Predicción por lotes: los ligandos se featurizan en paralelo y la inferencia se hace por batches.
+    Los SMILES inválidos se reportan por fila sin hacer fallar el lote.
+    Es síncrona: FastAPI la ejecuta en su pool de hilos y el event loop sigue atendiendo otras peticiones.
+    """
+    check_model()
+    results, batches = prepare_rows(data.data)
+    for rows, mol_batch, pro_batch in batches:
+        with torch.no_grad():
+            pKd = model(mol_batch, pro_batch).flatten().cpu()
+        for i, value in zip(rows, pKd.tolist()):
+            results[i] = {"status": "success", "pKd": value, "result": 10 ** (-value)}
+
+    return {"results": results}
+
+
+@app.post("/get_predictions_uncertainty", status_code=200)
+def get_predictions_uncertainty(data: UncertaintyRequest):
+    """
+    Predicción con incertidumbre por MC dropout: media, desviación típica y cuantiles de pKd por par.
+    """
+    check_model()
+    results, batches = prepare_rows(data.data)
+    for rows, mol_batch, pro_batch in batches:
+        stats = mc_dropout_predict(model, mol_batch, pro_batch, n_samples=data.n_samples, quantiles=data.quantiles)
+        for j, i in enumerate(rows):
+            results[i] = {"status": "success",
+                          "pKd_mean": stats["mean"][j],
+                          "pKd_std": stats["std"][j],
+                          "pKd_quantiles": {str(q): stats["quantiles"][k][j] for k, q in enumerate(data.quantiles)},
+                          "result": 10 ** (-stats["mean"][j])}
+
+    return {"results": results}
+
+
+@app.post("/mutational_scan", status_code=200)
+def mutational_scan(data: MutationalScanRequest):
+    """
+    Escaneo mutacional: puntúa todos los mutantes puntuales de la proteína frente al ligando
+    recalculando sólo la ventana afectada de la rama GCN de la proteína.
+    Es síncrona, como /get_predictions: se ejecuta en el pool de hilos de FastAPI.
+    """
+    check_model()
+    try:
+        scanner = MutationalScanner(model, data.protein_sequence, data.ligand_smiles)
+        mutations = enumerate_mutations(data.protein_sequence, data.positions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    preds = scanner.score(mutations)
+    results = [{"mutation": f"{wt}{p + 1}{mt}", "position": p, "wild_type": wt, "mutant": mt,
+                "pKd": pKd, "delta_pKd": pKd - scanner.wt_pred}
+               for (p, wt, mt), pKd in zip(mutations, preds)]
+    response = {"wild_type_pKd": scanner.wt_pred, "results": results}
+    if data.benchmark > 0:
+        response["benchmark"] = benchmark(scanner, mutations, n_reference=data.benchmark)
+    return response
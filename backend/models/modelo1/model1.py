@@ -43,13 +43,13 @@ def atom_features(atom):
 # ==============================================================
 # --- Convert SMILES to molecular graph (78-dim atom features)
 # ==============================================================
-def mol_to_graph_features(smiles):
+def mol_to_graph_arrays(smiles):
+    """Featurize a SMILES into compact numpy arrays (x: float32 [N, 78], edge_index: int64 [2, E])."""
     mol = Chem.MolFromSmiles(smiles)
     if mol is None:
         raise ValueError(f"Invalid SMILES: {smiles}")
 
-    atoms = mol.GetAtoms()
-    x = torch.tensor([atom_features(a) for a in atoms], dtype=torch.float)
+    x = np.array([atom_features(a) for a in mol.GetAtoms()], dtype=np.float32)
 
     # edges (bidirectional)
     edge_index = [[], []]
@@ -58,12 +58,19 @@ def mol_to_graph_features(smiles):
         edge_index[0] += [i, j]
         edge_index[1] += [j, i]
 
-    edge_index = torch.tensor(edge_index, dtype=torch.long)
+    edge_index = np.array(edge_index, dtype=np.int64).reshape(2, -1)
+    return x, edge_index
 
-    data = Data(x=x, edge_index=edge_index)
+
+def arrays_to_graph(x, edge_index):
+    data = Data(x=torch.from_numpy(x), edge_index=torch.from_numpy(edge_index))
     data.y = torch.zeros(1)
     return data
 
+
+def mol_to_graph_features(smiles):
+    return arrays_to_graph(*mol_to_graph_arrays(smiles))
+
 # ==============================================================
 # --- Convert protein sequence to graph (54-dim residue features)
 # ==============================================================
@@ -0,0 +1,70 @@
+import os
+
+import torch
+import torch.nn.functional as F
+
+# ==============================================================
+# --- Monte Carlo dropout in batched forwards
+# ==============================================================
+# En GNNNet el dropout sólo aparece en las capas densas (después del pooling),
+# así que los encoders GCN son deterministas: se calculan una vez y se replican
+# T veces en una dimensión extra antes de las capas densas.
+# Las capas densas se recorren aquí con F.dropout(training=True), sin tocar el
+# modo del modelo compartido con /get_predictions, y las T muestras se procesan
+# en bloques de MC_CHUNK para acotar la memoria ([chunk, B, 1024] por capa).
+
+MC_CHUNK = int(os.environ.get("MODELO1_MC_CHUNK", 32))
+
+
+def _dropout(model, x):
+    return F.dropout(x, model.dropout.p, training=True)
+
+
+def _mc_ligand_fc(model, x):
+    x = _dropout(model, model.relu(model.mol_fc_g1(x)))
+    return _dropout(model, model.mol_fc_g2(x))
+
+
+def _mc_protein_fc(model, xt):
+    xt = _dropout(model, model.relu(model.pro_fc_g1(xt)))
+    return _dropout(model, model.pro_fc_g2(xt))
+
+
+def _mc_combine(model, x, xt):
+    xc = _dropout(model, model.relu(model.fc1(torch.cat((x, xt), -1))))
+    xc = _dropout(model, model.relu(model.fc2(xc)))
+    return model.out(xc)
+
+
+def mc_dropout_predict(model, data_mol, data_pro, n_samples=50, quantiles=(0.05, 0.5, 0.95), chunk_size=MC_CHUNK):
+    """
+    Monte Carlo dropout estimate of pKd. The model itself is left untouched (it may be serving
+    other requests at the same time): dropout is applied functionally in a separate dense forward.
+    :param model: GNNNet in eval mode.
+    :param data_mol: Ligand graph (Data or Batch).
+    :param data_pro: Protein graph (Data or Batch).
+    :param n_samples: Number of dropout samples T.
+    :param quantiles: Quantiles of the predictive distribution to return.
+    :param chunk_size: Dropout samples run together in one dense forward.
+    :return: dict with "mean", "std" (lists of B floats) and "quantiles" (one list of B floats per quantile).
+    """
+    if n_samples < 2:
+        raise ValueError(f"n_samples must be at least 2, got {n_samples}")
+    if len(quantiles) == 0 or not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError(f"quantiles must be a non-empty list of values in [0, 1], got {list(quantiles)}")
+    with torch.no_grad():
+        x = model.ligand_conv(data_mol)
+        xt = model.protein_conv(data_pro)
+
+        samples = []
+        for start in range(0, n_samples, chunk_size):
+            t = min(chunk_size, n_samples - start)
+            x_t = x.unsqueeze(0).expand(t, -1, -1)     # [t, B, F]
+            xt_t = xt.unsqueeze(0).expand(t, -1, -1)
+            samples.append(_mc_combine(model, _mc_ligand_fc(model, x_t), _mc_protein_fc(model, xt_t)).squeeze(-1))
+        samples = torch.cat(samples)                    # [T, B]
+
+        q = torch.quantile(samples, torch.tensor(list(quantiles), dtype=samples.dtype, device=samples.device), dim=0)
+    return {"mean": samples.mean(0).cpu().tolist(),
+            "std": samples.std(0).cpu().tolist(),
+            "quantiles": q.cpu().tolist()}
@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import os
+from types import SimpleNamespace
+
+import torch
+
+# Backend de inferencia de los encoders: torch | int8 | onnx | onnx-int8
+ENCODER_BACKEND = os.environ.get("MODELO2_ENCODER_BACKEND", "torch")
+ONNX_DIR = os.environ.get("MODELO2_ONNX_DIR", "/app/onnx")
+ONNX_OPSET = 14
+# Grafo ONNX de la cabeza de afinidad de PLAPT (la ruta por defecto de Plapt)
+AFFINITY_MODEL = os.environ.get("MODELO2_AFFINITY_MODEL", "models/affinity_predictor.onnx")
+
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+ENCODERS = {"protein": "prot_encoder", "ligand": "mol_encoder"}
+
+
+class PooledEncoder(torch.nn.Module):
+    """Wraps a HuggingFace encoder so that it only returns pooler_output (what PLAPT uses)."""
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask).pooler_output
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime replacement for a HuggingFace encoder, callable like the original module.
+    :param path: Exported ONNX graph.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.device = torch.device("cpu")
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        # created lazily (and again after a fork): ONNX Runtime thread pools do not survive fork()
+        if self._session is None or self._pid != os.getpid():
+            import onnxruntime
+            self._session = onnxruntime.InferenceSession(self.path, providers=["CPUExecutionProvider"])
+            self._pid = os.getpid()
+        return self._session
+
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        pooled = self.session.run(["pooler_output"], {"input_ids": input_ids.cpu().numpy(),
+                                                      "attention_mask": attention_mask.cpu().numpy()})[0]
+        return SimpleNamespace(pooler_output=torch.from_numpy(pooled))
+
+
+def onnx_path(out_dir, name, quantized=False):
+    return os.path.join(out_dir, f"{name}{'.int8' if quantized else ''}.onnx")
+
+
+def export_onnx(plapt, out_dir=ONNX_DIR, quantize=False):
+    """
+    Export the ProtBERT and ChemBERTa encoders of a Plapt instance to ONNX (dynamic batch and length axes).
+    With quantize=True an int8 dynamically quantized copy of each graph is written too.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    dummy = {"protein": plapt.prot_tokenizer(["M K T"], return_tensors="pt"),
+             "ligand": plapt.mol_tokenizer(["CCO"], return_tensors="pt")}
+    for name, attr in ENCODERS.items():
+        encoder = PooledEncoder(getattr(plapt, attr)).cpu().eval()
+        path = onnx_path(out_dir, name)
+        torch.onnx.export(encoder, (dummy[name]["input_ids"], dummy[name]["attention_mask"]), path,
+                          input_names=["input_ids", "attention_mask"],
+                          output_names=["pooler_output"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "length"},
+                                        "attention_mask": {0: "batch", 1: "length"},
+                                        "pooler_output": {0: "batch"}},
+                          opset_version=ONNX_OPSET)
+        print(f"{name} encoder exported to {path}")
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(path, onnx_path(out_dir, name, quantized=True), weight_type=QuantType.QInt8)
+            print(f"{name} encoder quantized to {onnx_path(out_dir, name, quantized=True)}")
+
+
+def encoder_version(encoder, backend):
+    """
+    Identity of an encoder for the embedding caches: the backend plus a hash of the HuggingFace
+    checkpoint (name or path) it was loaded from, so cached embeddings never cross backends or models.
+    """
+    config = getattr(encoder, "config", None)
+    checkpoint = getattr(config, "name_or_path", None) or getattr(config, "_name_or_path", None) or "unknown"
+    return f"{backend}-{hashlib.sha256(checkpoint.encode('utf-8')).hexdigest()[:12]}"
+
+
+def apply_backend(plapt, backend=ENCODER_BACKEND, onnx_dir=ONNX_DIR):
+    """
+    Swap the encoders of a loaded Plapt instance for the selected CPU backend (in place).
+    :param backend: "torch" (unchanged), "int8" (torch dynamic quantization of nn.Linear),
+                    "onnx" or "onnx-int8" (ONNX Runtime over graphs written by export_onnx).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend}, expected one of {BACKENDS}")
+    # recorded before the swap: the ONNX encoders no longer know their HuggingFace checkpoint
+    plapt.encoder_versions = {name: encoder_version(getattr(plapt, attr), backend) for name, attr in ENCODERS.items()}
+    for name, attr in ENCODERS.items():
+        if backend == "int8":
+            encoder = getattr(plapt, attr).cpu()
+            setattr(plapt, attr, torch.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8))
+        elif backend.startswith("onnx"):
+            setattr(plapt, attr, OnnxEncoder(onnx_path(onnx_dir, name, quantized=backend == "onnx-int8")))
+    load_affinity_session(plapt)
+    return plapt
+
+
+def load_affinity_session(plapt, path=AFFINITY_MODEL):
+    """
+    (Re)create the ONNX Runtime session of the PLAPT affinity head from a known graph path, and keep
+    the path and providers on the module so that reset_after_fork can rebuild it.
+    Without the graph file the session created by Plapt is kept, and is not rebuilt after a fork.
+    """
+    module = plapt.prediction_module
+    session = getattr(module, "session", None)
+    if session is None or not os.path.exists(path):
+        return plapt
+    import onnxruntime
+    module.model_path = path
+    module.providers = session.get_providers()
+    module.session = onnxruntime.InferenceSession(path, providers=module.providers)
+    return plapt
+
+
+def reset_after_fork(plapt):
+    """
+    Recreate the ONNX Runtime session of the PLAPT affinity head in a forked worker, from the path
+    stored by load_affinity_session. The encoder weights stay shared with the parent (copy-on-write);
+    only the session is rebuilt.
+    """
+    module = plapt.prediction_module
+    model_path = getattr(module, "model_path", None)
+    if model_path is not None:
+        import onnxruntime
+        module.session = onnxruntime.InferenceSession(model_path, providers=module.providers)
+    return plapt
+
+
+if __name__ == "__main__":
+    from plapt import Plapt
+
+    parser = argparse.ArgumentParser(description="Export the PLAPT encoders to ONNX.")
+    parser.add_argument("output", nargs="?", default=ONNX_DIR)
+    parser.add_argument("--quantize", action="store_true", help="Also write int8 dynamically quantized graphs")
+    args = parser.parse_args()
+    export_onnx(Plapt(), args.output, args.quantize)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+PROTEIN_CACHE_SIZE = int(os.environ.get("MODELO2_PROTEIN_CACHE_SIZE", 64))
+LIGAND_CACHE_SIZE = int(os.environ.get("MODELO2_LIGAND_CACHE_SIZE", 20000))
+# Directorio del nivel en disco (float16); vacío = sólo memoria
+CACHE_DIR = os.environ.get("MODELO2_CACHE_DIR", "")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    LRU cache of encoder embeddings keyed by the hash of the input sequence/SMILES,
+    with an optional float16 on-disk tier that survives restarts.
+    :param name: Cache name, used as the on-disk subdirectory.
+    :param max_items: Maximum number of embeddings kept in memory.
+    :param disk_dir: Root directory of the on-disk tier (None disables it).
+    :param version: Encoder identity (backend and checkpoint); each version has its own on-disk subdirectory.
+    """
+    def __init__(self, name, max_items, disk_dir=None, version=None):
+        self.name = name
+        self.max_items = max_items
+        self.version = version
+        self.disk_dir = os.path.join(disk_dir, name, *([version] if version else [])) if disk_dir else None
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".npy")
+
+    def get(self, text):
+        key = text_hash(text)
+        with self.lock:
+            emb = self.memory.get(key)
+            if emb is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return emb
+        if self.disk_dir and os.path.exists(self._path(key)):
+            emb = torch.from_numpy(np.load(self._path(key)).astype(np.float32))
+            self._remember(key, emb)
+            self.disk_hits += 1
+            return emb
+        self.misses += 1
+        return None
+
+    def put(self, text, emb):
+        key = text_hash(text)
+        self._remember(key, emb)
+        if self.disk_dir:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, emb.numpy().astype(np.float16))
+            os.replace(tmp, path)
+
+    def _remember(self, key, emb):
+        with self.lock:
+            self.memory[key] = emb
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self.memory), "max_items": self.max_items, "disk": self.disk_dir,
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+def default_caches(versions=None):
+    """
+    Protein and ligand caches configured from the environment.
+    :param versions: Encoder identity per cache name ("protein", "ligand"), see backends.encoder_version.
+    """
+    disk_dir = CACHE_DIR or None
+    versions = versions or {}
+    return (EmbeddingCache("protein", PROTEIN_CACHE_SIZE, disk_dir, versions.get("protein")),
+            EmbeddingCache("ligand", LIGAND_CACHE_SIZE, disk_dir, versions.get("ligand")))
@@ -0,0 +1,157 @@
+import os
+import threading
+
+import numpy as np
+import torch
+
+# Mismas longitudes máximas que Plapt.tokenize
+PROT_MAX_LENGTH = 3200
+MOL_MAX_LENGTH = 278
+
+# Presupuesto de tokens (filas x longitud con padding) y filas máximas por bucket
+MAX_BATCH_TOKENS = int(os.environ.get("MODELO2_MAX_BATCH_TOKENS", 16384))
+MAX_BATCH_SIZE = int(os.environ.get("MODELO2_MAX_BATCH_SIZE", 64))
+
+
+def length_buckets(lengths, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Group indices by tokenized length so that each bucket pads to a similar length.
+    :param lengths: Token count of each input.
+    :return buckets: List of index lists; every bucket satisfies rows * max_length <= max_batch_tokens
+                     (a single over-long input gets its own bucket).
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    buckets, bucket = [], []
+    for i in order:
+        # lengths are sorted, so the new input sets the padded length of the bucket
+        if bucket and ((len(bucket) + 1) * lengths[i] > max_batch_tokens or len(bucket) >= max_batch_size):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+class PlaptEngine:
+    """
+    Batched inference over the components of a loaded Plapt instance
+    (ProtBERT and ChemBERTa encoders plus the affinity prediction module).
+    :param plapt: Loaded Plapt model.
+    :param protein_cache: Optional EmbeddingCache for ProtBERT embeddings.
+    :param ligand_cache: Optional EmbeddingCache for ChemBERTa embeddings.
+    :param ligand_store: Optional LigandStore of precomputed ChemBERTa embeddings, checked before the cache.
+    """
+    def __init__(self, plapt, protein_cache=None, ligand_cache=None, ligand_store=None):
+        self.plapt = plapt
+        self.device = plapt.prot_encoder.device
+        self.protein_cache = protein_cache
+        self.ligand_cache = ligand_cache
+        self.ligand_store = ligand_store
+        # los tokenizers "fast" de HuggingFace no admiten llamadas concurrentes desde varios hilos
+        self.tokenize_lock = threading.Lock()
+
+    def _encode(self, tokenizer, encoder, texts, max_length):
+        """Pooled encoder output for each text, running the encoder over length-bucketed padded batches."""
+        with self.tokenize_lock:
+            tokens = tokenizer(texts, max_length=max_length, truncation=True, padding=False)
+        lengths = [len(ids) for ids in tokens["input_ids"]]
+        out = [None] * len(texts)
+        for bucket in length_buckets(lengths):
+            with self.tokenize_lock:
+                batch = tokenizer.pad({"input_ids": [tokens["input_ids"][i] for i in bucket],
+                                       "attention_mask": [tokens["attention_mask"][i] for i in bucket]},
+                                      return_tensors="pt")
+            with torch.no_grad():
+                pooled = encoder(**batch.to(self.device)).pooler_output.cpu()
+            for i, row in zip(bucket, pooled):
+                out[i] = row
+        return torch.stack(out)
+
+    @staticmethod
+    def _cached(cache, texts, encode):
+        """Look texts up in the cache and only encode the misses."""
+        if cache is None:
+            return encode(texts)
+        out = [cache.get(t) for t in texts]
+        missing = [i for i, emb in enumerate(out) if emb is None]
+        if missing:
+            new = encode([texts[i] for i in missing])
+            for i, emb in zip(missing, new):
+                # a row of the batch output is a view: cloned so that a cached row does not keep the whole batch alive
+                emb = emb.cpu().clone()
+                out[i] = emb
+                cache.put(texts[i], emb)
+        return torch.stack(out)
+
+    def _encode_proteins(self, sequences):
+        sequences = [self.plapt.preprocess_sequence(seq) for seq in sequences]
+        return self._encode(self.plapt.prot_tokenizer, self.plapt.prot_encoder, sequences, PROT_MAX_LENGTH)
+
+    def _encode_ligands(self, smiles):
+        return self._encode(self.plapt.mol_tokenizer, self.plapt.mol_encoder, list(smiles), MOL_MAX_LENGTH)
+
+    def encode_proteins(self, sequences):
+        return self._cached(self.protein_cache, list(sequences), self._encode_proteins)
+
+    def encode_ligands(self, smiles):
+        smiles = list(smiles)
+        if self.ligand_store is None:
+            return self._cached(self.ligand_cache, smiles, self._encode_ligands)
+        rows = self.ligand_store.lookup(smiles)
+        found = np.nonzero(rows >= 0)[0]
+        if len(found) == len(smiles):
+            return self.ligand_store.get(rows)
+        missing = np.nonzero(rows < 0)[0]
+        encoded = self._cached(self.ligand_cache, [smiles[i] for i in missing], self._encode_ligands)
+        out = torch.empty(len(smiles), encoded.shape[1])
+        out[missing] = encoded
+        if len(found):
+            out[found] = self.ligand_store.get(rows[found])
+        return out
+
+    def predict_features(self, features):
+        """
+        Run the affinity head over a [N, D] feature matrix (protein embedding ++ ligand embedding).
+        :return affinities: One dict per row, as returned by Plapt.predict_affinity.
+        """
+        module = self.plapt.prediction_module
+        session = getattr(module, "session", None)
+        if session is None:
+            return module.predict(list(features))
+        inputs = {i.name: i for i in session.get_inputs()}
+        feature_input = inputs.get(getattr(module, "input_name", None))
+        if feature_input is None or set(inputs) - {feature_input.name, "TrainingMode"}:
+            # graph with inputs this engine does not know how to feed
+            return module.predict(list(features))
+
+        def feed(rows):
+            # same feed as PredictionModule.predict: the features plus the graph's TrainingMode flag
+            feed = {feature_input.name: rows}
+            if "TrainingMode" in inputs:
+                feed["TrainingMode"] = np.array(False)
+            return feed
+
+        x = features.numpy().astype(np.float32)
+        if isinstance(feature_input.shape[0], int):
+            # ONNX graph exported with a fixed batch size: one row at a time
+            preds = [session.run(None, feed(row.reshape(1, -1)))[0][0][0] for row in x]
+        else:
+            preds = session.run(None, feed(x))[0][:, 0]
+        return [module.convert_to_affinity(float(p)) for p in preds]
+
+    def predict(self, protein_sequences, ligand_smiles):
+        """
+        Predict the affinity of each (protein, ligand) pair. Repeated proteins and ligands are encoded once.
+        :return affinities: One dict per pair, in input order.
+        """
+        proteins = list(dict.fromkeys(protein_sequences))
+        ligands = list(dict.fromkeys(ligand_smiles))
+        prot_emb = self.encode_proteins(proteins)
+        mol_emb = self.encode_ligands(ligands)
+
+        prot_idx = {seq: i for i, seq in enumerate(proteins)}
+        mol_idx = {smi: i for i, smi in enumerate(ligands)}
+        features = torch.cat((prot_emb[[prot_idx[s] for s in protein_sequences]],
+                              mol_emb[[mol_idx[s] for s in ligand_smiles]]), dim=1)
+        return self.predict_features(features)
@@ -0,0 +1,11 @@
+import os
+
+# Varios procesos worker que comparten (copy-on-write) los pesos cargados por el maestro
+bind = "0.0.0.0:5002"
+workers = int(os.environ.get("MODELO2_WORKERS", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("MODELO2_TIMEOUT", 300))
+
+os.environ.setdefault("MODELO2_PRELOAD", "1")
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import logging
+import os
+
+import numpy as np
+import torch
+
+# Ruta del almacén precalculado de embeddings de ligandos; vacío = desactivado
+LIGAND_STORE = os.environ.get("MODELO2_LIGAND_STORE", "")
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "index.npz"
+
+
+def smiles_key(smiles):
+    """64-bit key of a SMILES (first 8 bytes of its SHA-256)."""
+    return np.frombuffer(hashlib.sha256(smiles.encode("utf-8")).digest()[:8], dtype=np.uint64)[0]
+
+
+class LigandStore:
+    """
+    Read-only, memory-mapped float16 matrix of precomputed ChemBERTa embeddings for a compound library.
+    :param path: Directory written by build_store.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        index = np.load(os.path.join(path, INDEX_FILE))
+        self.keys = index["keys"]      # sorted uint64 keys
+        self.rows = index["rows"]      # row of each key in the embedding matrix
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, smiles):
+        """
+        Find ligands in the store.
+        :return rows: Embedding row for each SMILES, -1 when it is not in the store.
+        """
+        if len(self.keys) == 0:
+            return np.full(len(smiles), -1, dtype=np.int64)
+        keys = np.array([smiles_key(s) for s in smiles], dtype=np.uint64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.rows[pos], -1)
+
+    def get(self, rows):
+        return torch.from_numpy(np.asarray(self.embeddings[rows], dtype=np.float32))
+
+
+def read_smiles(path, column=None, sep=","):
+    """SMILES from a text file (one per line, first token) or from a column of a delimited file."""
+    smiles = []
+    with open(path) as f:
+        if column is not None:
+            header = f.readline().rstrip("\n").split(sep)
+            col = header.index(column)
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            smiles.append(line.split(sep)[col] if column is not None else line.split()[0])
+    return smiles
+
+
+def build_store(engine, smiles, path, batch_size=1024):
+    """
+    Encode a SMILES library with the engine's ligand encoder and write it as a memory-mappable store.
+    Duplicated SMILES are stored once.
+    """
+    smiles = list(dict.fromkeys(smiles))
+    if not smiles:
+        raise ValueError("No SMILES to store: the compound library is empty")
+    os.makedirs(path, exist_ok=True)
+    first = engine.encode_ligands(smiles[:1])
+    embeddings = np.lib.format.open_memmap(os.path.join(path, EMBEDDINGS_FILE), mode="w+",
+                                           dtype=np.float16, shape=(len(smiles), first.shape[1]))
+    for start in range(0, len(smiles), batch_size):
+        chunk = smiles[start:start + batch_size]
+        embeddings[start:start + len(chunk)] = engine.encode_ligands(chunk).numpy().astype(np.float16)
+        logger.info("%d/%d ligands encoded", start + len(chunk), len(smiles))
+    embeddings.flush()
+
+    keys = np.array([smiles_key(s) for s in smiles], dtype=np.uint64)
+    order = np.argsort(keys)
+    np.savez(os.path.join(path, INDEX_FILE), keys=keys[order], rows=order.astype(np.int64))
+    return len(smiles)
+
+
+if __name__ == "__main__":
+    from plapt import Plapt
+    from engine import PlaptEngine
+
+    parser = argparse.ArgumentParser(description="Precompute ChemBERTa embeddings for a compound library.")
+    parser.add_argument("input", help="SMILES file (one per line) or delimited file with --column")
+    parser.add_argument("output", help="Output directory of the store")
+    parser.add_argument("--column", default=None, help="SMILES column name for delimited files")
+    parser.add_argument("--sep", default=",", help="Delimiter for --column files")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    engine = PlaptEngine(Plapt())
+    n = build_store(engine, read_smiles(args.input, args.column, args.sep), args.output, args.batch_size)
+    print(f"Store with {n} ligands written to {args.output}")
@@ -1,43 +1,201 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from plapt import Plapt
+from typing import List
+import asyncio
+import os
 import time
 
+import torch
+
+from engine import PlaptEngine
+from cache import default_caches
+from ligand_store import LigandStore, LIGAND_STORE
+from backends import apply_backend, reset_after_fork, ENCODER_BACKEND
 
-app = FastAPI()
 
 plapt_model: Plapt = None
+engine: PlaptEngine = None
 model_load_failed = False
+model_ready = False
+
+# Hilos de torch por proceso (0 = valor por defecto de torch)
+TORCH_THREADS = int(os.environ.get("MODELO2_TORCH_THREADS", 0))
+# Inferencias ejecutándose a la vez en cada proceso
+INFERENCE_WORKERS = int(os.environ.get("MODELO2_INFERENCE_WORKERS", 1))
+# Peticiones admitidas (en ejecución + en cola) antes de responder 429
+MAX_QUEUE = int(os.environ.get("MODELO2_MAX_QUEUE", 16))
+# Cargar el modelo al importar el módulo (gunicorn --preload: los workers comparten los pesos)
+PRELOAD = os.environ.get("MODELO2_PRELOAD", "0") == "1"
+
+executor: ThreadPoolExecutor = None
+pending = 0
+
+# Par de ejemplo usado para la inferencia de calentamiento
+WARMUP_PROTEIN = "MENFQKVEKIGEGTYGVVYKARNK"
+WARMUP_LIGAND = "CCO"
 
 
 class PredictionRequest(BaseModel):
     """Estructura esperada para la solicitud POST."""
-    protein_sequence: str 
-    ligand_smiles: str 
+    protein_sequence: str
+    ligand_smiles: str
 
 
+class BatchPredictionRequest(BaseModel):
+    data: List[PredictionRequest]
 
-@app.post("/get_prediction", status_code=200)
-async def get_prediction(data: PredictionRequest):
+
+def load_model():
+    """Carga PLAPT con el backend de encoders configurado (sin calentamiento)."""
+    global plapt_model, model_load_failed
+    start_time = time.time()
+    try:
+        plapt_model = apply_backend(Plapt(), ENCODER_BACKEND)
+    except Exception as e:
+        print(f"Error CRÍTICO al inicializar PLAPT después de {time.time() - start_time:.2f} segundos: {e}")
+        model_load_failed = True
+
+
+if PRELOAD:
+    # Se carga en el proceso maestro antes del fork; el calentamiento se hace en cada worker
+    # porque los pools de hilos de torch/ONNX Runtime no sobreviven al fork.
+    load_model()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Carga PLAPT una sola vez al arrancar (o reutiliza el precargado) y ejecuta una inferencia de calentamiento."""
+    global plapt_model, engine, executor, model_load_failed, model_ready
+    start_time = time.time()
+
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+    executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS)
+
+    if plapt_model is None and not model_load_failed:
+        load_model()
+    elif plapt_model is not None:
+        reset_after_fork(plapt_model)
+    try:
+        if plapt_model is not None:
+            protein_cache, ligand_cache = default_caches(plapt_model.encoder_versions)
+            ligand_store = LigandStore(LIGAND_STORE) if LIGAND_STORE else None
+            engine = PlaptEngine(plapt_model, protein_cache, ligand_cache, ligand_store)
+            engine.predict([WARMUP_PROTEIN], [WARMUP_LIGAND])
+            model_ready = True
+            print(f"Modelo PLAPT ({ENCODER_BACKEND}) listo en el proceso {os.getpid()} en {time.time() - start_time:.2f} segundos")
+    except Exception as e:
+        print(f"Error CRÍTICO al calentar PLAPT después de {time.time() - start_time:.2f} segundos: {e}")
+        model_load_failed = True
+    yield
+    executor.shutdown(wait=False)
+    plapt_model = None
+    engine = None
+    model_ready = False
+
+
+async def run_inference(fn, *args):
     """
-    Ruta para recibir secuencias (proteína y ligando) y devolver la afinidad de unión predicha.
+    Ejecuta la inferencia en el pool de hilos para no bloquear el event loop.
+    Si ya hay MAX_QUEUE peticiones pendientes en este proceso se responde 429.
     """
-    plapt_model = Plapt()
-    
-    if plapt_model is None:
+    global pending
+    if pending >= MAX_QUEUE:
+        raise HTTPException(status_code=429, detail="Servicio saturado, reintente más tarde.",
+                            headers={"Retry-After": "1"})
+    pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        pending -= 1
+
+
+app = FastAPI(
+    lifespan=lifespan,
+    title="Modelo2 Prediction API",
+    description="API para predicción de afinidad proteína-ligando usando PLAPT."
+)
+
+
+@app.get("/health", status_code=200)
+async def health():
+    """El proceso está vivo (aunque el modelo no esté cargado)."""
+    return {"status": "ok", "model_loaded": plapt_model is not None, "model_load_failed": model_load_failed,
+            "pid": os.getpid(), "pending": pending, "max_queue": MAX_QUEUE}
+
+
+@app.get("/ready", status_code=200)
+async def ready():
+    """El modelo está cargado y calentado, listo para recibir predicciones."""
+    if not model_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Modelo PLAPT no disponible." if model_load_failed else "Modelo PLAPT cargándose."
+        )
+    return {"status": "ready"}
+
+
+@app.get("/cache_stats", status_code=200)
+async def cache_stats():
+    """Estadísticas de las cachés de embeddings de proteína y ligando."""
+    check_model()
+    return {"protein": engine.protein_cache.stats(), "ligand": engine.ligand_cache.stats(),
+            "ligand_store": len(engine.ligand_store) if engine.ligand_store is not None else None}
+
+
+def check_model():
+    if engine is None or not model_ready:
         raise HTTPException(
-            status_code=503, 
+            status_code=503,
             detail="Servicio no disponible. El modelo PLAPT no se cargó correctamente al inicio."
         )
 
+
+@app.post("/get_prediction", status_code=200)
+async def get_prediction(data: PredictionRequest):
+    """
+    Ruta para recibir secuencias (proteína y ligando) y devolver la afinidad de unión predicha.
+    """
+    check_model()
+
     try:
-        results = plapt_model.predict_affinity(data.protein_sequence, data.ligand_smiles)
+        results = await run_inference(engine.predict, [data.protein_sequence], [data.ligand_smiles])
         return {"results":results}
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error interno durante la predicción: {e}")
         raise HTTPException(
-            status_code=500, 
+            status_code=500,
             detail=f"Error al procesar la predicción: {str(e)}"
         )
 
+
+@app.post("/get_predictions", status_code=200)
+async def get_predictions(data: BatchPredictionRequest):
+    """
+    Predicción por lotes: los encoders se ejecutan sobre buckets agrupados por longitud tokenizada
+    y la cabeza de afinidad sobre todo el lote. Los resultados mantienen el orden de entrada.
+    """
+    check_model()
+    if not data.data:
+        raise HTTPException(status_code=400, detail="No data provided")
+
+    try:
+        results = await run_inference(engine.predict,
+                                      [pair.protein_sequence for pair in data.data],
+                                      [pair.ligand_smiles for pair in data.data])
+        return {"results": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error interno durante la predicción por lotes: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al procesar la predicción: {str(e)}"
+        )
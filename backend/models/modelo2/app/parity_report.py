@@ -0,0 +1,75 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from plapt import Plapt
+from engine import PlaptEngine
+from backends import apply_backend, BACKENDS, ONNX_DIR
+
+# Pares por defecto: el receptor CCR9 frente a varios ligandos de ejemplo
+CCR9 = (
+    "ASMEDYVNFNFEDFYCEKNNVRQFASHFLPPLYWLVFIVGALGNSLVILVYWYCARAKTATDMFLLNLAIADLLFLVTLPFWAIAAADQWKFQTFMCKVVNSMYKMNFYSCVLLIMCICVDRYIAIAQAMRAHTWREKRLLYSKMVCFTIWVLAAALCIPEILYSQIKEESGIAICTMVYPSDESTKLKSAVLALKVILGFFLPFVVMACCYTIIIHTLIQAKKSSKHKALKATITVLTVFVLSQFPYNCILLVQTIDAYAMFISNCAVSTAIDICFQVTQAIAFFHSCLNPVLYVFVGERFRRDLVKTLKNLGAISQAAAHHHHHHHHHH"
+)
+DEFAULT_LIGANDS = [
+    "CCC1=NN=C2N1C3=C(C4=C(S3)CCC4)C(=NC2)C5=CC=CC=C5Cl",
+    "CC(=O)OC1=CC=CC=C1C(=O)O",
+    "CN1C=NC2=C1C(=O)N(C(=O)N2C)C",
+    "CC(C)CC1=CC=C(C=C1)C(C)C(=O)O",
+    "CCO",
+]
+
+
+def read_pairs(path):
+    """Pairs from a CSV with protein_sequence,ligand_smiles columns."""
+    proteins, ligands = [], []
+    with open(path) as f:
+        header = f.readline().strip().split(",")
+        p, l = header.index("protein_sequence"), header.index("ligand_smiles")
+        for line in f:
+            cols = line.strip().split(",")
+            if len(cols) > max(p, l):
+                proteins.append(cols[p])
+                ligands.append(cols[l])
+    return proteins, ligands
+
+
+def timed_predict(engine, proteins, ligands):
+    t = time.time()
+    preds = engine.predict(proteins, ligands)
+    return np.array([r["neg_log10_affinity_M"] for r in preds]), time.time() - t
+
+
+def parity_report(backend, proteins, ligands, onnx_dir=ONNX_DIR):
+    """Compare affinity predictions of an encoder backend against the full-precision torch encoders."""
+    reference, t_ref = timed_predict(PlaptEngine(Plapt()), proteins, ligands)
+    candidate, t_cand = timed_predict(PlaptEngine(apply_backend(Plapt(), backend, onnx_dir)), proteins, ligands)
+    diff = np.abs(candidate - reference)
+    return {"backend": backend,
+            "n_pairs": len(proteins),
+            "max_abs_diff_pKd": float(diff.max()),
+            "mean_abs_diff_pKd": float(diff.mean()),
+            "rmse_pKd": float(np.sqrt((diff ** 2).mean())),
+            "pearson": float(np.corrcoef(reference, candidate)[0, 1]) if len(proteins) > 1 else None,
+            "torch_seconds": t_ref,
+            "backend_seconds": t_cand}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity of an encoder backend against the torch encoders.")
+    parser.add_argument("backend", choices=[b for b in BACKENDS if b != "torch"])
+    parser.add_argument("--pairs", default=None, help="CSV with protein_sequence,ligand_smiles columns")
+    parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    if args.pairs:
+        proteins, ligands = read_pairs(args.pairs)
+    else:
+        proteins, ligands = [CCR9] * len(DEFAULT_LIGANDS), DEFAULT_LIGANDS
+    report = parity_report(args.backend, proteins, ligands, args.onnx_dir)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,188 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from loguru import logger
+
+# batches between two mid-epoch checkpoints (0 = only at the end of each epoch)
+CHECKPOINT_EVERY = int(os.environ.get("MODELO3_CHECKPOINT_EVERY", 0))
+
+def rng_state():
+    """State of the python, numpy and torch (CPU and CUDA) generators, in types torch.load accepts with weights_only."""
+    numpy_state = np.random.get_state()
+    state = {"python": random.getstate(),
+             "numpy": (numpy_state[0], numpy_state[1].tolist()) + tuple(numpy_state[2:]),
+             "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    numpy_state = state["numpy"]
+    np.random.set_state((numpy_state[0], np.array(numpy_state[1], dtype=np.uint32)) + tuple(numpy_state[2:]))
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def snapshot(state):
+    """Copy of a (nested) state dict with every tensor on the CPU, safe to write while training goes on."""
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: snapshot(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(v) for v in state)
+    return state
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file renamed over path: a crash never leaves a truncated checkpoint."""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class Checkpointer:
+    """
+    Resumable training state of a model: last.pt holds the model, optimizer, scheduler, RNG state,
+    epoch/batch position and early-stopping counters; best.pt the model with the best validation
+    metric so far. The state is copied to the CPU in the training thread and written atomically by
+    a background thread, one checkpoint at a time.
+    :param path: Checkpoint directory.
+    :param every: Batches between mid-epoch checkpoints (0 = end of epochs only).
+    """
+    def __init__(self, path, model, optimizer, scheduler=None, every=CHECKPOINT_EVERY):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.every = every
+        self.best_metric = float('-inf')
+        self.best_epoch = None
+        self.no_improvement = 0
+        self.start_epoch = 0
+        self.resume_state = None
+        self.epoch_rng = None
+        self.writer = ThreadPoolExecutor(1)
+        self.pending = None
+
+    @property
+    def last_path(self):
+        return os.path.join(self.path, "last.pt")
+
+    @property
+    def best_path(self):
+        return os.path.join(self.path, "best.pt")
+
+    def state(self, epoch, batch):
+        return snapshot({"model": self.model.state_dict(),
+                         "optimizer": self.optimizer.state_dict(),
+                         "scheduler": self.scheduler.state_dict() if self.scheduler is not None else None,
+                         "rng": rng_state(),
+                         "epoch_rng": self.epoch_rng,
+                         "epoch": epoch,
+                         "batch": batch,
+                         "best_metric": self.best_metric,
+                         "best_epoch": self.best_epoch,
+                         "no_improvement": self.no_improvement})
+
+    def write(self, obj, path):
+        # at most one checkpoint in flight: the next one waits for the previous write
+        self.wait()
+        self.pending = self.writer.submit(atomic_save, obj, path)
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def save(self, epoch, batch=None):
+        """
+        Checkpointing the training state.
+        :param batch: Last batch done in the epoch (None = whole epoch done, resume at the next one).
+        """
+        self.write(self.state(epoch, batch), self.last_path)
+        logger.info(f"checkpoint epoch {epoch}" + (f" batch {batch}" if batch is not None else "") + f" to {self.last_path}")
+
+    def observe(self, metric, epoch):
+        """
+        Early-stopping bookkeeping of a validation metric (higher is better). An improvement resets
+        the counter and keeps the model in best.pt.
+        :return improved: Whether the metric is the best so far.
+        """
+        if metric > self.best_metric:
+            self.best_metric = metric
+            self.best_epoch = epoch
+            self.no_improvement = 0
+            self.write({"model": snapshot(self.model.state_dict()), "epoch": epoch, "metric": metric}, self.best_path)
+            return True
+        self.no_improvement += 1
+        return False
+
+    def restore_best(self):
+        """Loading the best model kept by observe into the model (no-op when there is none)."""
+        self.wait()
+        if self.best_epoch is not None and os.path.exists(self.best_path):
+            best = torch.load(self.best_path, map_location='cpu')
+            self.model.load_state_dict(best["model"])
+            logger.info(f"restore best model (epoch {best['epoch']}, metric {best['metric']:.4f}) from {self.best_path}")
+
+    def resume(self, path=None):
+        """
+        Restoring the training state of a checkpoint (default last.pt of the directory).
+        :return start_epoch: First epoch to run; a checkpoint taken mid-epoch resumes that epoch.
+        """
+        path = path or self.last_path
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no checkpoint to resume from at {path}")
+        state = torch.load(path, map_location='cpu')
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        if self.scheduler is not None and state["scheduler"] is not None:
+            self.scheduler.load_state_dict(state["scheduler"])
+        self.best_metric = state["best_metric"]
+        self.best_epoch = state["best_epoch"]
+        self.no_improvement = state["no_improvement"]
+        if state["batch"] is None:
+            set_rng_state(state["rng"])
+            self.start_epoch = state["epoch"] + 1
+        else:
+            # replayed by batches: same shuffle as the interrupted epoch, then the RNG of the checkpoint
+            self.resume_state = state
+            self.start_epoch = state["epoch"]
+        logger.info(f"resume from {path}: epoch {state['epoch']}, batch {state['batch']}")
+        return self.start_epoch
+
+    def batches(self, epoch, batches):
+        """
+        Wrapping the (index, batch) iterator of a training epoch: records the RNG state before the
+        loader shuffles, skips the batches already done when resuming mid-epoch, and checkpoints
+        every `every` batches.
+        """
+        skip = 0
+        if self.resume_state is not None and self.resume_state["epoch"] == epoch:
+            set_rng_state(self.resume_state["epoch_rng"])
+            skip = self.resume_state["batch"] + 1
+        self.epoch_rng = rng_state()
+        for i, batch in batches:
+            if i < skip:
+                continue
+            if i == skip and self.resume_state is not None:
+                set_rng_state(self.resume_state["rng"])
+                self.resume_state = None
+            yield i, batch
+            if self.every and (i + 1) % self.every == 0:
+                self.save(epoch, i)
+        if self.resume_state is not None and self.resume_state["epoch"] == epoch:
+            # the checkpoint was taken after the last batch of the epoch
+            set_rng_state(self.resume_state["rng"])
+            self.resume_state = None
+
+    def close(self):
+        self.wait()
+        self.writer.shutdown()
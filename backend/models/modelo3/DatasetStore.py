@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+from Utils import first_rows
+
+STORE_DIR = os.environ.get("MODELO3_DATASET_STORE", "output/datasets/")
+TDC_PATH = os.environ.get("MODELO3_TDC_PATH", "./data")
+# no download: datasets missing from the store are an error (air-gapped training nodes)
+OFFLINE = os.environ.get("MODELO3_OFFLINE", "0") == "1"
+
+# dataset -> (affinities converted to p-values first, binarization threshold), as trained by MINDG
+BINARIZATION = {"DAVIS": (True, 7),
+                "BindingDB_Kd": (True, 7.6),
+                "KIBA": (False, 12.1)}
+
+class DatasetStore:
+    """
+    Local copies of the TDC DTI datasets, written once and then read without network access.
+    Every dataset is kept as Arrow IPC files: a table of distinct drugs (Drug_ID, Drug), one of
+    distinct targets (Target_ID, Target), and the pairs as integer rows into them with their
+    affinity Y and, for the datasets in BINARIZATION, the binarized label. The files are
+    uncompressed and memory-mapped, so loading is a take over the entity tables.
+    :param store_dir: Root directory of the store.
+    :param offline: Never download: a dataset missing from the store raises FileNotFoundError.
+    """
+    def __init__(self, store_dir=STORE_DIR, offline=OFFLINE, tdc_path=TDC_PATH):
+        self.store_dir = store_dir
+        self.offline = offline
+        self.tdc_path = tdc_path
+
+    def path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.path(name), "metadata.json"))
+
+    def materialize(self, name):
+        """Downloading a dataset with TDC, converting and binarizing it, and writing it to the store."""
+        if self.offline:
+            raise FileNotFoundError(f"dataset {name} is not in {self.store_dir} (offline mode)")
+        from tdc.multi_pred import DTI
+        data_dti = DTI(name=name, path=self.tdc_path)
+        df = data_dti.get_data()
+        columns = {"y": df['Y'].to_numpy()}
+        if name in BINARIZATION:
+            to_log, threshold = BINARIZATION[name]
+            if to_log:
+                data_dti.convert_to_log(form='binding')
+            data_dti.binarize(threshold=threshold, order='descending')
+            columns["y_binary"] = np.asarray(data_dti.get_data()['Y'])
+
+        drug_codes = df.groupby(['Drug_ID', 'Drug'], sort=False, dropna=False).ngroup().to_numpy()
+        target_codes = df.groupby(['Target_ID', 'Target'], sort=False, dropna=False).ngroup().to_numpy()
+        drugs = df[['Drug_ID', 'Drug']].iloc[first_rows(drug_codes, drug_codes.max() + 1)]
+        targets = df[['Target_ID', 'Target']].iloc[first_rows(target_codes, target_codes.max() + 1)]
+        pairs = pa.table({"drug": pa.array(drug_codes.astype(np.int32)),
+                          "target": pa.array(target_codes.astype(np.int32)),
+                          **{k: pa.array(v) for k, v in columns.items()}})
+
+        # written aside and renamed: a partially written dataset is never read
+        path = self.path(name)
+        tmp = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        write_table(os.path.join(tmp, "drugs.arrow"), pa.Table.from_pandas(drugs, preserve_index=False))
+        write_table(os.path.join(tmp, "targets.arrow"), pa.Table.from_pandas(targets, preserve_index=False))
+        write_table(os.path.join(tmp, "pairs.arrow"), pairs)
+        with open(os.path.join(tmp, "metadata.json"), "w") as f:
+            json.dump({"name": name, "pairs": len(df), "drugs": len(drugs), "targets": len(targets),
+                       "binarization": BINARIZATION.get(name)}, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f"save {name} ({len(df)} pairs, {len(drugs)} drugs, {len(targets)} targets) to {path}")
+
+    def load(self, name, binarized=False):
+        """
+        A dataset as the DataFrame of DTI(name).get_data() (Drug_ID, Drug, Target_ID, Target, Y).
+        :param binarized: Y binarized as in MINDG.run (p-values when converted, threshold of BINARIZATION).
+        """
+        if binarized and name not in BINARIZATION:
+            raise ValueError(f"dataset {name} has no binarization threshold")
+        if not self.exists(name):
+            self.materialize(name)
+        path = self.path(name)
+        drugs = read_table(os.path.join(path, "drugs.arrow")).to_pandas()
+        targets = read_table(os.path.join(path, "targets.arrow")).to_pandas()
+        pairs = read_table(os.path.join(path, "pairs.arrow"))
+        drug_rows = pairs.column("drug").to_numpy()
+        target_rows = pairs.column("target").to_numpy()
+        df = pd.DataFrame({"Drug_ID": drugs['Drug_ID'].to_numpy()[drug_rows],
+                           "Drug": drugs['Drug'].to_numpy()[drug_rows],
+                           "Target_ID": targets['Target_ID'].to_numpy()[target_rows],
+                           "Target": targets['Target'].to_numpy()[target_rows],
+                           "Y": pairs.column("y_binary" if binarized else "y").to_numpy()})
+        logger.info(f"load {name} ({len(df)} pairs) from {path}")
+        return df
+
+    def get_split(self, name, seed=42, frac=[0.7, 0.1, 0.2], binarized=False):
+        """Train/valid/test DataFrames, the same as DTI(name).get_split(method='random', seed, frac)."""
+        return random_split(self.load(name, binarized), seed, frac)
+
+def write_table(path, table):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def read_table(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def random_split(df, seed, frac):
+    """TDC's random split (tdc.utils.split.create_fold), so the splits match the ones of DTI.get_split."""
+    train_frac, val_frac, test_frac = frac
+    test = df.sample(frac=test_frac, replace=False, random_state=seed)
+    train_val = df[~df.index.isin(test.index)]
+    val = train_val.sample(frac=val_frac / (1 - test_frac), replace=False, random_state=1)
+    train = train_val[~train_val.index.isin(val.index)]
+    return {"train": train.reset_index(drop=True),
+            "valid": val.reset_index(drop=True),
+            "test": test.reset_index(drop=True)}
+
+_default_store = None
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = DatasetStore()
+    return _default_store
+
+def load_dataset(name, binarized=False):
+    return default_store().load(name, binarized)
+
+def get_split(name, seed=42, frac=[0.7, 0.1, 0.2], binarized=False):
+    return default_store().get_split(name, seed, frac, binarized)
+
+if __name__ == '__main__':
+    # run once on a node with network access, then copy the store to the training nodes
+    import sys
+    store = DatasetStore(offline=False)
+    for name in sys.argv[1:] or list(BINARIZATION):
+        if not store.exists(name):
+            store.materialize(name)
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils import data
+from loguru import logger
+
+from DeepPurpose import utils
+
+from Utils import first_rows
+
+CACHE_DIR = os.environ.get("MODELO3_DATASET_CACHE")
+
+class DTI_Dataset(data.Dataset):
+    """
+    Drug-target pairs for MINDG and HDN, stored column-wise. The DataFrame written by
+    dti_df_process is converted once: every distinct drug keeps a single MPNN feature, every
+    distinct protein is embedded once (one-hot CNN input), and the pairs become integer columns
+    pointing to them, so __getitem__ is plain array indexing.
+    :param idx_map: Graph node ID -> node index.
+    :param df: DataFrame from dti_df_process.
+    :param cache_dir: Optional directory where the arrays are kept between runs (proteins are memory-mapped).
+    """
+    def __init__(self, idx_map, df, cache_dir=CACHE_DIR):
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, fingerprint(df, idx_map))
+        if path is not None and os.path.exists(os.path.join(path, "columns.npz")):
+            self.load(path)
+            logger.info(f"load dataset ({len(self)} pairs) from {path}")
+        else:
+            self.build(idx_map, df)
+            if path is not None:
+                self.save(path)
+
+    def build(self, idx_map, df):
+        drug_codes, drugs = pd.factorize(df['Seq_Drug'])
+        target_codes, targets = pd.factorize(df['Seq_Target'])
+        drug_first = first_rows(drug_codes, len(drugs))
+        target_first = first_rows(target_codes, len(targets))
+        self.drugs = [df['drug_encoding'].iloc[i] for i in drug_first]
+        proteins = np.stack([utils.protein_2_embed(df['target_encoding'].iloc[i]) for i in target_first])
+        # CNN inputs are one-hot: a byte per entry is enough
+        self.proteins = proteins.astype(np.uint8) if np.array_equal(proteins, proteins.astype(np.uint8)) \
+            else proteins.astype(np.float32)
+        self.drug_rows = drug_codes.astype(np.int64)
+        self.protein_rows = target_codes.astype(np.int64)
+        self.idx1 = np.array([idx_map[str(i)] for i in df['Graph_Drug']], dtype=np.int64)
+        self.idx2 = np.array([idx_map[i] for i in df['Graph_Target']], dtype=np.int64)
+        self.y = df['Seq_Label'].to_numpy()
+        self.label = df['Graph_Label'].to_numpy()
+
+    def save(self, path):
+        # written aside and renamed: concurrent runs share the cache, and a worker may be reading
+        # (memory-mapping) the arrays of the same split while another one writes them
+        tmp = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "proteins.npy"), self.proteins)
+        torch.save(self.drugs, os.path.join(tmp, "drugs.pt"))
+        np.savez(os.path.join(tmp, "columns.npz"), drug_rows=self.drug_rows, protein_rows=self.protein_rows,
+                 idx1=self.idx1, idx2=self.idx2, y=self.y, label=self.label)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another run saved the same split first
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f"save dataset ({len(self)} pairs, {len(self.drugs)} drugs, {len(self.proteins)} proteins) to {path}")
+
+    def load(self, path):
+        self.proteins = np.load(os.path.join(path, "proteins.npy"), mmap_mode='r')
+        self.drugs = torch.load(os.path.join(path, "drugs.pt"))
+        columns = np.load(os.path.join(path, "columns.npz"))
+        self.drug_rows = columns['drug_rows']
+        self.protein_rows = columns['protein_rows']
+        self.idx1 = columns['idx1']
+        self.idx2 = columns['idx2']
+        self.y = columns['y']
+        self.label = columns['label']
+
+    def __len__(self):
+        'Denotes the total number of samples'
+        return len(self.y)
+
+    def __getitem__(self, index):
+        'Generates one sample of data'
+        v_d = self.drugs[self.drug_rows[index]]
+        v_p = np.asarray(self.proteins[self.protein_rows[index]], dtype=np.float32)
+        return v_d, v_p, self.y[index], self.idx1[index], self.idx2[index], self.label[index]
+
+def fingerprint(df, idx_map):
+    """
+    Content hash of the pairs of a split and of the graph node indices, used as cache key:
+    the cached idx1/idx2 are only valid for the idx_map they were built with.
+    """
+    columns = ['Seq_Drug', 'Seq_Target', 'Seq_Label', 'Graph_Drug', 'Graph_Target', 'Graph_Label']
+    hashed = pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy()
+    nodes = pd.DataFrame({"node": [str(node) for node in idx_map], "index": list(idx_map.values())})
+    digest = hashlib.sha256(hashed.tobytes())
+    digest.update(pd.util.hash_pandas_object(nodes, index=False).to_numpy().tobytes())
+    return f"{len(df)}_{digest.hexdigest()[:16]}"
@@ -0,0 +1,160 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from loguru import logger
+
+from DeepPurpose import utils
+
+try:
+    from importlib.metadata import version
+    DEEPPURPOSE_VERSION = version("DeepPurpose")
+except Exception:
+    DEEPPURPOSE_VERSION = "unknown"
+
+CACHE_DIR = os.environ.get("MODELO3_ENCODING_CACHE", "output/encodings/")
+WORKERS = int(os.environ.get("MODELO3_ENCODE_WORKERS", os.cpu_count() or 1))
+MIN_PARALLEL = int(os.environ.get("MODELO3_ENCODE_MIN_PARALLEL", 64))
+
+def mpnn_arrays(smiles):
+    """MPNN feature of a SMILES without the MAX_ATOM/MAX_BOND padding, as numpy arrays."""
+    fatoms, fbonds, agraph, bgraph, n = utils.smiles2mpnnfeature(smiles)
+    n_atoms, n_bonds = int(n[0, 0]), int(n[0, 1])
+    return (fatoms[:n_atoms].numpy().astype(np.float32), fbonds[:n_bonds].numpy().astype(np.float32),
+            agraph[:n_atoms].numpy().astype(np.int32), bgraph[:n_bonds].numpy().astype(np.int32))
+
+def mpnn_feature(fatoms, fbonds, agraph, bgraph):
+    """Padding unpadded arrays back to the MPNN feature returned by utils.smiles2mpnnfeature."""
+    n_atoms, n_bonds = len(fatoms), len(fbonds)
+    fatoms = torch.cat([torch.from_numpy(fatoms), torch.zeros(utils.MAX_ATOM - n_atoms, fatoms.shape[1])], 0)
+    fbonds = torch.cat([torch.from_numpy(fbonds), torch.zeros(utils.MAX_BOND - n_bonds, fbonds.shape[1])], 0)
+    agraph = torch.cat([torch.from_numpy(agraph).float(), torch.zeros(utils.MAX_ATOM - n_atoms, agraph.shape[1])], 0)
+    bgraph = torch.cat([torch.from_numpy(bgraph).float(), torch.zeros(utils.MAX_BOND - n_bonds, bgraph.shape[1])], 0)
+    return [fatoms, fbonds, agraph, bgraph, torch.Tensor([n_atoms, n_bonds]).view(1, -1)]
+
+def cnn_codes(sequence):
+    """CNN input of a protein (utils.trans_protein) as a fixed-width byte array."""
+    return np.array(utils.trans_protein(sequence), dtype='S1')
+
+class MPNNCodec:
+    name = 'MPNN'
+    encode = staticmethod(mpnn_arrays)
+
+    @staticmethod
+    def pack(values):
+        parts = list(zip(*values))
+        sizes = np.array([[len(v[0]), len(v[1])] for v in values], dtype=np.int64).reshape(-1, 2)
+        return {'fatoms': np.concatenate(parts[0]), 'fbonds': np.concatenate(parts[1]),
+                'agraph': np.concatenate(parts[2]), 'bgraph': np.concatenate(parts[3]), 'sizes': sizes}
+
+    @staticmethod
+    def unpack(arrays):
+        sizes = arrays['sizes']
+        atom_ends, bond_ends = np.cumsum(sizes[:, 0]), np.cumsum(sizes[:, 1])
+        return [mpnn_feature(arrays['fatoms'][a_end - n_a:a_end], arrays['fbonds'][b_end - n_b:b_end],
+                             arrays['agraph'][a_end - n_a:a_end], arrays['bgraph'][b_end - n_b:b_end])
+                for (n_a, n_b), a_end, b_end in zip(sizes, atom_ends, bond_ends)]
+
+class CNNCodec:
+    name = 'CNN'
+    encode = staticmethod(cnn_codes)
+
+    @staticmethod
+    def pack(values):
+        return {'codes': np.stack(values)}
+
+    @staticmethod
+    def unpack(arrays):
+        return [[c.decode() for c in row] for row in arrays['codes']]
+
+CODECS = {('drug', 'MPNN'): MPNNCodec, ('protein', 'CNN'): CNNCodec}
+
+class EncodingCache:
+    """
+    DeepPurpose encodings of drugs and proteins kept across runs, keyed by (SMILES or sequence,
+    encoding, DeepPurpose version). Only the entities never seen before are encoded, each once,
+    in a process pool; they are appended to the cache as a new shard of compact arrays
+    (MPNN features without their padding, CNN inputs as one byte per residue).
+    :param cache_dir: Root directory of the cache (None keeps it in memory only).
+    :param workers: Encoding processes.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, workers=WORKERS):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.memory = {}
+
+    def path(self, kind, encoding):
+        return os.path.join(self.cache_dir, f"{kind}_{encoding}_{DEEPPURPOSE_VERSION}")
+
+    def table(self, kind, encoding):
+        key = (kind, encoding)
+        if key not in self.memory:
+            self.memory[key] = {}
+            if self.cache_dir is not None and os.path.isdir(self.path(kind, encoding)):
+                self.load(kind, encoding)
+        return self.memory[key]
+
+    def load(self, kind, encoding):
+        codec, path, table = CODECS[(kind, encoding)], self.path(kind, encoding), self.memory[(kind, encoding)]
+        for name in sorted(f for f in os.listdir(path) if f.endswith('.json')):
+            with open(os.path.join(path, name)) as f:
+                entities = json.load(f)
+            with np.load(os.path.join(path, name[:-len('.json')] + '.npz')) as arrays:
+                table.update(zip(entities, codec.unpack(arrays)))
+        logger.info(f"load {len(table)} {kind} {encoding} encodings from {path}")
+
+    def save(self, kind, encoding, entities, values):
+        codec, path = CODECS[(kind, encoding)], self.path(kind, encoding)
+        os.makedirs(path, exist_ok=True)
+        shard = f"shard_{len([f for f in os.listdir(path) if f.endswith('.json')]):05d}_{os.getpid()}"
+        np.savez(os.path.join(path, shard + '.npz'), **codec.pack(values))
+        # the entity list is written last: a shard without it is ignored
+        with open(os.path.join(path, shard + '.json'), 'w') as f:
+            json.dump(entities, f)
+        logger.info(f"save {len(entities)} {kind} {encoding} encodings to {path}/{shard}")
+
+    def encode(self, entities, kind, encoding):
+        """
+        Encodings of a list of entities.
+        :param kind: 'drug' or 'protein'.
+        :return encodings: Dict entity -> encoding in the DeepPurpose format.
+        """
+        codec = CODECS[(kind, encoding)]
+        table = self.table(kind, encoding)
+        missing = [e for e in dict.fromkeys(entities) if e not in table]
+        if missing:
+            if self.workers > 1 and len(missing) >= MIN_PARALLEL:
+                with ProcessPoolExecutor(self.workers) as pool:
+                    values = list(pool.map(codec.encode, missing, chunksize=max(1, len(missing) // (4 * self.workers))))
+            else:
+                values = [codec.encode(e) for e in missing]
+            if self.cache_dir is not None:
+                self.save(kind, encoding, missing, values)
+            table.update(zip(missing, codec.unpack(codec.pack(values))))
+        return {e: table[e] for e in entities}
+
+_default_cache = None
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EncodingCache()
+    return _default_cache
+
+def encode_drug(df, drug_encoding, column_name='SMILES', save_column_name='drug_encoding'):
+    """Drop-in replacement of utils.encode_drug that goes through the encoding cache."""
+    if ('drug', drug_encoding) not in CODECS:
+        return utils.encode_drug(df, drug_encoding, column_name, save_column_name)
+    encodings = default_cache().encode(df[column_name].tolist(), 'drug', drug_encoding)
+    df[save_column_name] = [encodings[i] for i in df[column_name]]
+    return df
+
+def encode_protein(df, target_encoding, column_name='Target Sequence', save_column_name='target_encoding'):
+    """Drop-in replacement of utils.encode_protein that goes through the encoding cache."""
+    if ('protein', target_encoding) not in CODECS:
+        return utils.encode_protein(df, target_encoding, column_name, save_column_name)
+    encodings = default_cache().encode(df[column_name].tolist(), 'protein', target_encoding)
+    df[save_column_name] = [encodings[i] for i in df[column_name]]
+    return df
@@ -0,0 +1,82 @@
+import os
+import time
+
+import torch
+from torch.utils import data
+from tqdm import tqdm
+from loguru import logger
+
+from Metrics import ScoreAccumulator
+
+NUM_WORKERS = int(os.environ.get("MODELO3_NUM_WORKERS", 0))
+PREFETCH_FACTOR = int(os.environ.get("MODELO3_PREFETCH_FACTOR", 2))
+
+def make_loader(dataset, batch_size, train, collate_fn=None, num_workers=NUM_WORKERS, prefetch_factor=PREFETCH_FACTOR):
+    """
+    DataLoader shared by the modelo3 training scripts. Training batches are shuffled and the last
+    incomplete one is dropped; evaluation keeps every sample so the metrics cover the whole split.
+    With workers, they are kept alive across epochs and prefetch batches ahead of the model.
+    :param train: Training loader (shuffle, drop_last) or evaluation loader.
+    :param num_workers: Loading processes (0 = main process).
+    """
+    params = {'batch_size': batch_size,
+              'shuffle': train,
+              'drop_last': train,
+              'num_workers': num_workers,
+              'pin_memory': torch.cuda.is_available()}
+    if collate_fn is not None:
+        params['collate_fn'] = collate_fn
+    if num_workers > 0:
+        params['persistent_workers'] = True
+        params['prefetch_factor'] = prefetch_factor
+    return data.DataLoader(dataset, **params)
+
+def train_epoch(loader, step, desc, recorder=None, epoch=None, checkpointer=None):
+    """
+    One pass over the training loader.
+    :param step: Callable batch -> (loss, pred, label); it runs forward, backward and the optimizer step.
+    :param recorder: Recorder buffering the loss of every batch; it is flushed at the end of the epoch.
+    :param checkpointer: Checkpointer taking mid-epoch checkpoints (and skipping the batches done when resuming).
+    :return result: Dict with the mean batch loss, the labels and logits seen and the throughput.
+    """
+    t = time.time()
+    epoch_loss = 0
+    n_batches = 0
+    scores = ScoreAccumulator()
+    batches = enumerate(tqdm(loader, desc))
+    if checkpointer is not None:
+        batches = checkpointer.batches(epoch, batches)
+    for i, batch in batches:
+        loss, pred, label = step(batch)
+        loss = loss.item()
+        epoch_loss += loss
+        n_batches += 1
+        if recorder is not None:
+            recorder.record({'epoch': epoch, 'batch': i, 'loss': loss, 'avg_loss': epoch_loss/n_batches})
+        scores.update(label.detach().flatten().cpu().numpy(), pred.detach().flatten().cpu().numpy())
+    if recorder is not None:
+        recorder.flush()
+    result = summarize(t, scores, desc)
+    result['epoch_loss'] = epoch_loss / max(n_batches, 1)
+    return result
+
+@torch.no_grad()
+def evaluate(loader, predict, desc='metrics'):
+    """
+    One pass over an evaluation loader.
+    :param predict: Callable batch -> (pred, label).
+    :return result: Dict with the labels and logits of the whole split and the throughput.
+    """
+    t = time.time()
+    scores = ScoreAccumulator()
+    for batch in tqdm(loader, desc):
+        pred, label = predict(batch)
+        scores.update(label.flatten().cpu().numpy(), pred.flatten().cpu().numpy())
+    return summarize(t, scores, desc)
+
+def summarize(t, scores, desc):
+    seconds = time.time() - t
+    result = {'y_label': scores.y_label, 'y_pred': scores.y_score, 'samples': len(scores), 'seconds': seconds,
+              'samples_per_sec': len(scores) / seconds if seconds > 0 else 0.0}
+    logger.info(f"{desc}: {len(scores)} samples in {seconds:.2f}s, {result['samples_per_sec']:.1f} samples/s")
+    return result
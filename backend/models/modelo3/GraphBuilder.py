@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import torch
+from loguru import logger
+
+GRAPH_CACHE = os.environ.get("MODELO3_GRAPH_CACHE")
+
+def factorize_nodes(drug_ids, target_ids):
+    """
+    Node indices of an interaction list: drugs first, then targets, in order of appearance.
+    :param drug_ids: Drug ID of every interaction.
+    :param target_ids: Target ID of every interaction.
+    :return idx: Node IDs (position = node index).
+    :return n_drugs: Number of drug nodes.
+    :return edges: Array [E, 2] of node indices (one row per interaction, duplicates kept).
+    """
+    drug_codes, drugs = pd.factorize(pd.Series(drug_ids).astype(str))
+    target_codes, targets = pd.factorize(pd.Series(target_ids))
+    n_drugs = len(drugs)
+    idx = np.concatenate((np.asarray(drugs, dtype=object), np.asarray(targets, dtype=object)))
+    edges = np.stack((drug_codes, target_codes + n_drugs), axis=1).astype(np.int64)
+    return idx, n_drugs, edges
+
+def normalized_adjacency(edges, node_count):
+    """
+    D^-1/2 (A + 2I) D^-1/2 of the undirected graph of the edges, in float32 CSR arrays. Duplicate
+    and reversed edges are merged, so A is binary and symmetric, and the degrees are the row counts.
+    :param edges: Array [E, 2] of node indices.
+    :param node_count: Number of nodes.
+    :return indptr, indices, values: CSR arrays (sorted column indices within each row).
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    keys = np.concatenate((edges[:, 0] * node_count + edges[:, 1], edges[:, 1] * node_count + edges[:, 0],
+                           np.arange(node_count, dtype=np.int64) * (node_count + 1)))
+    keys = np.unique(keys)
+    rows, cols = keys // node_count, keys % node_count
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=node_count), out=indptr[1:])
+    # every row holds its neighbours and the diagonal: degree of A + 2I = neighbours + 2
+    dinv = np.power(np.diff(indptr).astype(np.float32) + 1, -0.5)
+    values = np.where(rows == cols, np.float32(2), np.float32(1)) * dinv[rows] * dinv[cols]
+    return indptr, cols.astype(np.int64), values.astype(np.float32)
+
+def to_propagator(indptr, indices, values, device=torch.device('cpu')):
+    """Propagation matrix (dict with indices and values) from the CSR arrays."""
+    rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    propagation_matrix = dict()
+    propagation_matrix["indices"] = torch.from_numpy(np.vstack((rows, np.asarray(indices)))).to(device)
+    propagation_matrix["values"] = torch.from_numpy(np.array(values, dtype=np.float32)).to(device)
+    return propagation_matrix
+
+def save_propagator(path, indptr, indices, values):
+    """Writing the CSR arrays as .npy files, loadable memory-mapped."""
+    os.makedirs(path, exist_ok=True)
+    for name, array in (("indptr", indptr), ("indices", indices), ("values", values)):
+        np.save(os.path.join(path, f"propagator_{name}.npy"), array)
+    logger.info(f"save propagator ({len(indptr) - 1} nodes, {len(indices)} entries) to {path}")
+
+def load_propagator(path, mmap_mode='r'):
+    """CSR arrays written by save_propagator, None when the directory has none."""
+    files = [os.path.join(path, f"propagator_{name}.npy") for name in ("indptr", "indices", "values")]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    return tuple(np.load(f, mmap_mode=mmap_mode) for f in files)
+
+def fingerprint(df):
+    """Content hash of the interaction list of a graph, used as cache key."""
+    hashed = pd.util.hash_pandas_object(df[['Drug_ID', 'Target_ID']].astype(str), index=False).to_numpy()
+    return f"{len(df)}_{hashlib.sha256(hashed.tobytes()).hexdigest()[:16]}"
+
+def build_graph(df, device=torch.device('cpu'), cache_dir=GRAPH_CACHE):
+    """
+    Interaction graph of a DataFrame with Drug_ID and Target_ID columns.
+    :param cache_dir: Optional directory where graphs are kept between runs, keyed by the interaction
+                      list, so runs on the same data share one memory-mapped copy.
+    :return graph: Dict with idx, idx_map, n_drugs, edges, csr (indptr, indices, values) and propagation_matrix.
+    """
+    path = os.path.join(cache_dir, fingerprint(df)) if cache_dir is not None else None
+    csr = load_propagator(path) if path is not None else None
+    if csr is not None and os.path.exists(os.path.join(path, "nodes.json")):
+        with open(os.path.join(path, "nodes.json")) as f:
+            nodes = json.load(f)
+        idx, n_drugs = np.array(nodes["nodes"], dtype=object), nodes["n_drugs"]
+        edges = np.load(os.path.join(path, "edges.npy"), mmap_mode='r')
+        logger.info(f"load graph ({len(idx)} nodes) from {path}")
+    else:
+        idx, n_drugs, edges = factorize_nodes(df['Drug_ID'].values, df['Target_ID'].values)
+        csr = normalized_adjacency(edges, len(idx))
+        if path is not None:
+            # written aside and renamed: concurrent runs never read a partial graph
+            tmp = f"{path}.tmp{os.getpid()}"
+            save_propagator(tmp, *csr)
+            np.save(os.path.join(tmp, "edges.npy"), edges)
+            with open(os.path.join(tmp, "nodes.json"), "w") as f:
+                json.dump({"nodes": [str(i) for i in idx], "n_drugs": int(n_drugs)}, f)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+    return {"idx": idx,
+            "idx_map": {j: i for i, j in enumerate(idx)},
+            "n_drugs": n_drugs,
+            "edges": edges,
+            "csr": csr,
+            "propagation_matrix": to_propagator(*csr, device)}
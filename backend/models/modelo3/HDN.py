@@ -14,40 +14,19 @@ from sklearn.metrics import roc_auc_score, average_precision_score,\
 from tqdm import tqdm
 from loguru import logger
 import pandas as pd
-from tdc.multi_pred import DTI
 
 from DeepPurpose import utils, dataset
 from DeepPurpose import DTI as models
 from DeepPurpose.utils import *
 from DeepPurpose.dataset import *
 
-from Utils import csv_record,check_dir,save_model,class_metrics
-
-class DTI_Dataset(data.Dataset):
-    # df : a list of data, which includes an index for the pair, an index for entity1 and entity2, from a list that combines all the entities. we want the
-    def __init__(self, idx_map, df):
-        'Initialization'
-        self.idx_map = idx_map
-        self.df = df
-
-    def __len__(self):
-        'Denotes the total number of samples'
-        return len(self.df)
-
-    def __getitem__(self, index):
-        'Generates one sample of data'
-        # Select sample
-        # Load data and get label
-        idx1 = self.idx_map[str(self.df.iloc[index].Graph_Drug)]
-        idx2 = self.idx_map[self.df.iloc[index].Graph_Target]
-        label = self.df.iloc[index].Graph_Label
-        drug_encoding = self.df.iloc[index].drug_encoding
-        target_encoding = self.df.iloc[index].target_encoding
-        v_d = drug_encoding
-        v_p = utils.protein_2_embed(target_encoding)
-        y = self.df.iloc[index].Seq_Label
-        return v_d, v_p , y, idx1, idx2,label
-
+from Utils import csv_record,check_dir,save_model,class_metrics,setup_seed,BASE_PATH
+from Engine import make_loader, train_epoch, evaluate
+from Recorder import Recorder
+from Datasets import DTI_Dataset
+from EncodingCache import encode_drug, encode_protein
+from DatasetStore import load_dataset, random_split
+from Metrics import binary_metrics, auroc
 
 def get_model():
     drug_encoding, target_encoding = 'MPNN', 'CNN'
@@ -68,36 +47,15 @@ def get_model():
 
 def calc_score(model, data_loader,batch_size):
     model.eval()
-    batch_total = len(data_loader)
-    y_pred = np.empty([batch_total,batch_size])
-    y_label = np.empty([batch_total,batch_size])
-    for i in tqdm(range(batch_total), 'metrics'):
-        v_d, v_p, y,idx_1,idx_2,label  = next(iter(data_loader))
-        pred = model(v_d, v_p)
-        label_ids = y.numpy()
-        y_label[i] = label_ids
-        y_pred[i] = pred.flatten().detach().numpy()
-    y_pred = y_pred.flatten()
-    y_label = y_label.flatten()
-    # y_max = y_pred.max()
-    # y_min = y_pred.min()
+    def predict(batch):
+        v_d, v_p, y,idx_1,idx_2,label = batch
+        return model(v_d, v_p), y
+    scores = evaluate(data_loader, predict)
+    y_pred = scores['y_pred']
+    y_label = scores['y_label']
     threshold = 0.5
-    y_pred_binary = np.empty(batch_total*batch_size)
-    for i in range(len(y_pred_binary)):
-        if y_pred[i] >  threshold:
-            y_pred_binary[i] = 1
-        else:
-            y_pred_binary[i] = 0
-    auprc = average_precision_score(y_label, y_pred)
-    auroc = roc_auc_score(y_label, y_pred)
-    # f1 = f1_score(y_label, y_pred_binary)
-    # recall  = recall_score(y_label, y_pred_binary)
-    # sensitivity = recall
-    # precision = precision_score(y_label, y_pred_binary)
-    # accuracy = accuracy_score(y_label, y_pred_binary)
-    result = class_metrics(y_label, y_pred_binary)
-    result['auprc'] = auprc
-    result['auroc'] = auroc
+    result = binary_metrics(y_label, y_pred, threshold)
+    result['samples_per_sec'] = scores['samples_per_sec']
     return result
 
 def id_df_process(df):
@@ -125,17 +83,21 @@ def dti_df_process(df):
                         5:'Graph_Label'}, 
                             inplace=True)
     drug_encoding, target_encoding = 'MPNN', 'CNN'
-    df = utils.encode_drug(df, drug_encoding, column_name='Seq_Drug')
-    df = utils.encode_protein(df, target_encoding, column_name='Seq_Target')
+    # cached across splits and runs, each distinct drug/protein is only encoded once
+    df = encode_drug(df, drug_encoding, column_name='Seq_Drug')
+    df = encode_protein(df, target_encoding, column_name='Seq_Target')
     return df
 
-def train(name):
-    batch_size = 32
-    epochs = 20
-    learning_rate = 5e-4
-    early_stopping = 10
+def train(name, batch_size=32, epochs=20, learning_rate=5e-4, seed_id=None, base_path=BASE_PATH):
+    """
+    Training the HDN (DeepPurpose MPNN + CNN) view alone on a TDC DTI dataset.
+    :param seed_id: Seed of the run (None leaves the random state untouched).
+    :param base_path: Root of the output/ directory (MODELO3_BASE_PATH by default).
+    :return result: Test metrics.
+    """
+    if seed_id is not None:
+        setup_seed(seed_id)
     
-    base_path = "/home/yang/sda/github/MINDG/"
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
     root_path = base_path+f'output/{name}/'+now +'/'
     csv_path = root_path
@@ -148,15 +110,15 @@ def train(name):
     log_fd = logger.add(log_path+"/train.log")
     
     # generate ID map
-    data_dti = DTI(name = name)
-    split = data_dti.get_split(method = 'random', seed = 42, frac = [1.0, 0, 0])
+    data_dti = load_dataset(name)
+    split = random_split(data_dti, seed = 42, frac = [1.0, 0, 0])
     df = id_df_process(split['train'])
     logger.info(f"{name}: \n{df.head(5)}")
     idx = np.concatenate((df['Drug_ID'].unique(), df['Target_ID'].unique()))
     idx_map = {j: i for i, j in enumerate(idx)}
     
     # train/valid/test dataframe
-    split = data_dti.get_split(method = 'random', seed = 42, frac = [0.7, 0.1, 0.2])
+    split = random_split(data_dti, seed = 42, frac = [0.7, 0.1, 0.2])
     df_train = dti_df_process(id_df_process(split['train']))
     df_valid = dti_df_process(id_df_process(split['valid']))
     df_test = dti_df_process(id_df_process(split['test']))
@@ -165,28 +127,14 @@ def train(name):
     logger.info(f'test: {df_test.shape}')
     logger.info(f'df_train: \n {df_train.head(5)}')
     
-    train_params = {'batch_size': batch_size,
-                    'shuffle': True,
-                    # 'num_workers': 6,
-                    'drop_last': True,
-                    'collate_fn': utils.mpnn_collate_func
-                    }
-
-    test_params = {'batch_size': batch_size,
-                    'shuffle': False,
-                    # 'num_workers': 6,
-                    'drop_last': True,
-                    'collate_fn': utils.mpnn_collate_func
-                    }
-
     train_dataset = DTI_Dataset(idx_map, df_train)
-    train_loader = data.DataLoader(train_dataset, **train_params)
+    train_loader = make_loader(train_dataset, batch_size, train=True, collate_fn=utils.mpnn_collate_func)
 
     valid_dataset = DTI_Dataset(idx_map, df_valid)
-    valid_loader = data.DataLoader(valid_dataset, **test_params)
+    valid_loader = make_loader(valid_dataset, batch_size, train=False, collate_fn=utils.mpnn_collate_func)
 
     test_dataset = DTI_Dataset(idx_map, df_test)
-    test_loader = data.DataLoader(test_dataset, **test_params)
+    test_loader = make_loader(test_dataset, batch_size, train=False, collate_fn=utils.mpnn_collate_func)
     
 
     # v_d, v_p, y,idx_1,idx_2,label = next(iter(train_dataset))
@@ -221,16 +169,13 @@ def train(name):
     # model = models.model_pretrained(model = 'MPNN_CNN_BindingDB') # networks download pretrained models
     
     logger.info('Start Training...')
+    loss_recorder = Recorder(csv_path+"hdn_loss.csv")
     t_total = time.time()
     for epoch in range(epochs):
         hdn_model.train() # train stage
         t = time.time()
-        epoch_loss = 0
-        batch_total = len(train_loader)
-        y_pred_train = np.empty([batch_total,batch_size])
-        y_label_train = np.empty([batch_total,batch_size])
-        for i in tqdm(range(batch_total), f"train epoch{epoch + 1}"):
-            v_d, v_p, y,idx_1,idx_2,label = next(iter(train_loader))
+        def step(batch):
+            v_d, v_p, y,idx_1,idx_2,label = batch
             optimizer.zero_grad()
             drug, target =  v_d, v_p
             pred = hdn_model(drug, target)
@@ -239,30 +184,30 @@ def train(name):
             loss = torch.nn.functional.binary_cross_entropy_with_logits(pred, label)
             loss.backward()
             optimizer.step()
-            epoch_loss += loss.item()
-            csv_record(csv_path+"hdn_loss.csv",{'epoch':epoch, 'batch':i, 'loss':loss.item(), 'avg_loss':epoch_loss/(i+1)})
-            y_label_train[i] =  label.flatten().numpy()
-            y_pred_train[i] =  pred.detach().flatten().numpy()
-        y_label_train = y_label_train.flatten()
-        y_pred_train = y_pred_train.flatten()
-        logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(i + 1) + '/' +
-                        str(len(train_loader)) + ' Training loss: ' + str(loss.cpu().detach().numpy()))
-        roc_train = roc_auc_score(y_label_train, y_pred_train)
+            return loss, pred, label
+        train_result = train_epoch(train_loader, step, f"train epoch{epoch + 1}", loss_recorder, epoch)
+        y_label_train = train_result['y_label']
+        y_pred_train = train_result['y_pred']
+        logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(len(train_loader)) + '/' +
+                        str(len(train_loader)) + ' Training loss: ' + str(train_result['epoch_loss']))
+        roc_train = auroc(y_label_train, y_pred_train)
         # validation after each epoch
         result = calc_score(hdn_model, valid_loader,batch_size)
         result['epoch'] = epoch
-        result['epoch_loss'] = epoch_loss/batch_total
+        result['epoch_loss'] = train_result['epoch_loss']
         csv_record(csv_path+"hdn_val_metrics.csv",result)
         logger.info(f'Train: {result}')
         roc_val,prc_val, f1_val = result['auroc'],result['auprc'],result['f1']
 
-        logger.info('epoch: {:04d}'.format(epoch + 1),
-                'auroc_train: {:.4f}'.format(roc_train),
-                'auroc_val: {:.4f}'.format(roc_val),
-                'auprc_val: {:.4f}'.format(prc_val),
-                'f1_val: {:.4f}'.format(f1_val),
+        logger.info('epoch: {:04d}, '.format(epoch + 1)+
+                'auroc_train: {:.4f}, '.format(roc_train)+
+                'auroc_val: {:.4f}, '.format(roc_val)+
+                'auprc_val: {:.4f}, '.format(prc_val)+
+                'f1_val: {:.4f}, '.format(f1_val)+
+                'train: {:.1f} samples/s, '.format(train_result['samples_per_sec'])+
                 'time: {:.4f}s'.format(time.time() - t))
 
+    loss_recorder.close()
     logger.info("Optimization Finished!")
     logger.info("Total time elapsed: {:.4f}s".format(time.time() - t_total))
 
@@ -274,6 +219,7 @@ def train(name):
     csv_record(csv_path+"hdn_test_metrics.csv",result)
     print(f'Test: {result}')
     logger.remove(log_fd)
+    return result
 
 
 if __name__ == '__main__':
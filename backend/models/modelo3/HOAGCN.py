@@ -1,5 +1,6 @@
 import time
 import datetime
+import argparse
 
 import torch
 from torch import nn
@@ -14,10 +15,16 @@ from sklearn.metrics import roc_auc_score, average_precision_score,\
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from tdc.multi_pred import DTI
 from loguru import logger
 
-from Utils import csv_record,check_dir,save_model,class_metrics
+from Utils import csv_record,check_dir,save_model,class_metrics,identity_features,setup_seed,BASE_PATH
+from Subgraph import NeighborSampler, receptive_field
+from Engine import make_loader, train_epoch, evaluate
+from Recorder import Recorder, log_array
+from GraphBuilder import build_graph
+from DatasetStore import load_dataset, random_split
+from Checkpoint import Checkpointer
+from Metrics import binary_metrics, auroc
 
 class SparseNGCNLayer(torch.nn.Module):
     """
@@ -58,10 +65,25 @@ class SparseNGCNLayer(torch.nn.Module):
         :param features: Feature matrix.
         :return base_features: Convolved features.
         """
-        feature_count, _ = torch.max(features["indices"], dim=1)
-        feature_count = feature_count + 1
-        base_features = spmm(features["indices"], features["values"], feature_count[0],
-                             feature_count[1], self.weight_matrix)
+        if features.get("identity"):
+            # identity features: X W is just the rows of W of the nodes (the first node_count rows
+            # for the whole graph); nodes added after training have no row of W and get zeros
+            node_count = features["dimensions"][0]
+            node_ids = features.get("node_ids")
+            if node_ids is None and node_count <= self.weight_matrix.shape[0]:
+                base_features = self.weight_matrix[:node_count]
+            else:
+                if node_ids is None:
+                    node_ids = torch.arange(node_count, device=self.weight_matrix.device)
+                known = node_ids < self.weight_matrix.shape[0]
+                if bool(known.all()):
+                    base_features = self.weight_matrix[node_ids]
+                else:
+                    base_features = self.weight_matrix.new_zeros(len(node_ids), self.weight_matrix.shape[1])
+                    base_features[known] = self.weight_matrix[node_ids[known]]
+        else:
+            base_features = spmm(features["indices"], features["values"], features["dimensions"][0],
+                                 features["dimensions"][1], self.weight_matrix)
 
         base_features = base_features + self.bias
 
@@ -224,35 +246,67 @@ class MixHopNetwork(torch.nn.Module):
                 latent_features: latent representations of nodes
         """
         latent_features = self.embed(normalized_adjacency_matrix, features)
+        predictions = self.score(latent_features, idx)
+        return predictions, latent_features
 
+    def score(self, latent_features, idx):
+        """
+        Pair scoring head over precomputed latent features.
+        :param latent_features: Node representations returned by embed.
+        :param idx: Tuple with the node indices of both ends of each pair.
+        :return predictions: Label predictions (logits).
+        """
         feat_p1 = latent_features[idx[0]]
         feat_p2 = latent_features[idx[1]]
         feat = F.elu(self.bilinear(feat_p1, feat_p2))
         feat = F.dropout(feat, self.dropout, training=self.training)
         predictions = self.decoder(feat)
-        return predictions, latent_features
+        return predictions
+
+    def score_all(self, latent_features, query, candidates, query_first=True, chunk_size=4096):
+        """
+        Scoring one node against many candidate nodes (a whole row or column of the interaction
+        matrix). The bilinear form is contracted with the query once, so each chunk of candidates
+        is a single matrix product followed by the decoder.
+        :param latent_features: Node representations returned by embed.
+        :param query: Node index of the query.
+        :param candidates: LongTensor with the node indices of the candidates.
+        :param query_first: True when the query is the first end of the pairs (a drug).
+        :param chunk_size: Number of candidates scored per step.
+        :return predictions: Logits, one per candidate.
+        """
+        x = latent_features[query]
+        if query_first:
+            projected = torch.einsum('i,kij->jk', x, self.bilinear.weight)
+        else:
+            projected = torch.einsum('kij,j->ik', self.bilinear.weight, x)
+        predictions = []
+        for start in range(0, len(candidates), chunk_size):
+            feat = latent_features[candidates[start:start + chunk_size]] @ projected
+            if self.bilinear.bias is not None:
+                feat = feat + self.bilinear.bias
+            feat = F.elu(feat)
+            feat = F.dropout(feat, self.dropout, training=self.training)
+            predictions.append(self.decoder(feat))
+        return torch.cat(predictions).flatten()
 
 
 class Data_DTI(data.Dataset):
     # df : a list of data, which includes an index for the pair, an index for entity1 and entity2, from a list that combines all the entities. we want the
     def __init__(self, idx_map, labels, df):
         'Initialization'
-        self.labels = labels
-        self.idx_map = idx_map
-        self.df = df
+        # node indices are resolved once, __getitem__ only indexes arrays
+        self.labels = np.asarray(labels)
+        self.idx1 = np.array([idx_map[str(i)] for i in df['Drug_ID']], dtype=np.int64)
+        self.idx2 = np.array([idx_map[i] for i in df['Target_ID']], dtype=np.int64)
 
     def __len__(self):
         'Denotes the total number of samples'
-        return len(self.df)
+        return len(self.labels)
 
     def __getitem__(self, index):
         'Generates one sample of data'
-        # Select sample
-        # Load data and get label
-        idx1 = self.idx_map[str(self.df.iloc[index].Drug_ID)]
-        idx2 = self.idx_map[self.df.iloc[index].Target_ID]
-        y = self.labels[index]
-        return y, (idx1, idx2)
+        return self.labels[index], (self.idx1[index], self.idx2[index])
 
 def normalize_adjacency_matrix(A, I):
     """
@@ -303,38 +357,31 @@ def features_to_sparse(features, device):
     out_features["dimensions"] = features.shape
     return out_features
 
-def calc_score(model, data_loader,batch_size, propagation_matrix, features):
+def calc_score(model, data_loader,batch_size, propagation_matrix, features, sampler=None):
     model.eval()
-    batch_total = len(data_loader)
-    y_pred = np.empty([batch_total,batch_size])
-    y_label = np.empty([batch_total,batch_size])
-    for i in tqdm(range(batch_total), 'metrics'):
-        label, pairs = next(iter(data_loader))
-        output, latent_feature = model(propagation_matrix, features, pairs)
-        label_ids = label.numpy()
-        y_label[i] = label_ids
-        y_pred[i] = output.flatten().detach().numpy()
-    y_pred = y_pred.flatten()
-    y_label = y_label.flatten()
-    # y_max = y_pred.max()
-    # y_min = y_pred.min()
+    if sampler is not None:
+        # mini-batch mode: every batch is scored on its sampled subgraph, never on the whole graph
+        rng = sampler.eval_rng()
+        device = propagation_matrix["indices"].device
+        def predict(batch):
+            label, pairs = batch
+            with torch.no_grad():
+                sub_propagation_matrix, sub_features, sub_pairs = sampler.sample(pairs[0], pairs[1], device, rng)
+                prediction, _ = model(sub_propagation_matrix, sub_features, sub_pairs)
+            return prediction, label
+    else:
+        with torch.no_grad():
+            # eval mode is deterministic: the latent features are computed once for all batches
+            latent_features = model.embed(propagation_matrix, features)
+        def predict(batch):
+            label, pairs = batch
+            return model.score(latent_features, pairs), label
+    scores = evaluate(data_loader, predict)
+    y_pred = scores['y_pred']
+    y_label = scores['y_label']
     threshold = 0.5
-    y_pred_binary = np.empty(batch_total*batch_size)
-    for i in range(len(y_pred_binary)):
-        if y_pred[i] >  threshold:
-            y_pred_binary[i] = 1
-        else:
-            y_pred_binary[i] = 0
-    auprc = average_precision_score(y_label, y_pred)
-    auroc = roc_auc_score(y_label, y_pred)
-    # f1 = f1_score(y_label, y_pred_binary)
-    # recall  = recall_score(y_label, y_pred_binary)
-    # sensitivity = recall
-    # precision = precision_score(y_label, y_pred_binary)
-    # accuracy = accuracy_score(y_label, y_pred_binary)
-    result = class_metrics(y_label, y_pred_binary)
-    result['auprc'] = auprc
-    result['auroc'] = auroc
+    result = binary_metrics(y_label, y_pred, threshold)
+    result['samples_per_sec'] = scores['samples_per_sec']
     return result
 
 def dti_data_preprocess(df, oversampling=True):
@@ -353,8 +400,7 @@ def dti_data_preprocess(df, oversampling=True):
     logger.info(f'neg samples(0): {neg_label_num}, pos samples(1): {pos_label_num}, {neg_label_num * 100 //(neg_label_num + pos_label_num)}%')
     if oversampling:
         logger.info('oversampling')
-        for _ in range(pos_label_num//neg_label_num):
-            df = df.append(neg_samples,ignore_index=True)
+        df = pd.concat([df] + [neg_samples] * (pos_label_num//neg_label_num), ignore_index=True)
         neg_samples = df[df.Label == 0]
         pos_samples =  df[df.Label == 1]
         neg_label_num = neg_samples.shape[0]
@@ -362,13 +408,20 @@ def dti_data_preprocess(df, oversampling=True):
         logger.info(f'neg samples(0): {neg_label_num}, pos samples(1): {pos_label_num}, {neg_label_num * 100 //(neg_label_num + pos_label_num)}%')
     return df
 
-def train(name, device=torch.device('cpu')):
-    batch_size = 32
-    epochs = 20
-    learning_rate = 5e-4
-    early_stopping = 10
+def train(name, device=torch.device('cpu'), sampled=False, fanouts=None, batch_size=32, epochs=20, learning_rate=5e-4,
+          early_stopping=10, seed_id=None, base_path=BASE_PATH, resume=None):
+    """
+    Training HOAGCN on a TDC DTI dataset.
+    :param sampled: Mini-batch mode: propagate over the sampled neighbourhood of each batch only, in training and evaluation.
+    :param fanouts: Neighbours expanded per node at each hop in mini-batch mode (None = all, exact but only bounded by the neighbourhood size).
+    :param seed_id: Seed of the run (None leaves the random state untouched).
+    :param base_path: Root of the output/ directory (MODELO3_BASE_PATH by default).
+    :param resume: Checkpoint to resume training from ('last' = latest checkpoint of this dataset).
+    :return result: Test metrics.
+    """
+    if seed_id is not None:
+        setup_seed(seed_id)
     
-    base_path = "/home/yang/sda/github/MINDG/"
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
     root_path = base_path+f'output/{name}/'+now +'/'
     csv_path = root_path
@@ -381,145 +434,119 @@ def train(name, device=torch.device('cpu')):
     log_fd = logger.add(log_path+"/train.log")
     
     
-    data_dti = DTI(name = name)
-    split = data_dti.get_split(method = 'random', seed = 42, frac = [1.0, 0, 0])
+    data_dti = load_dataset(name)
+    split = random_split(data_dti, seed = 42, frac = [1.0, 0, 0])
     
     df = dti_data_preprocess(split['train'])
     logger.info(f"{name}: \n {df}")
-    idx = df['Drug_ID'].tolist()+df['Target_ID'].tolist()
-    idx = list(set(idx))
-    idx = np.array(idx)
+    graph = build_graph(df, device)
+    idx = graph["idx"]
     idx_total = len(idx)
-    idx_map = {j: i for i, j in enumerate(idx)}
-    
-    edges_unordered = df[['Drug_ID', 'Target_ID']].values
-    # print(f'edges_unordered:{len(edges_unordered)}')
-    
-    features = np.eye(idx_total)  # Drug_ID + Target_ID
-    features = features_to_sparse(features, device)
-    
-    edges = np.array(list(map(idx_map.get, edges_unordered.flatten()))).reshape(edges_unordered.shape)
-    # print(edges)
-    adj = sp.coo_matrix((np.ones(edges.shape[0]), (edges[:, 0], edges[:, 1])),
-                        shape=(len(idx), len(idx)),
-                        dtype=np.float32)
-    # print(adj)
-    # build symmetric adjacency matrix
-    adj = adj + adj.T.multiply(adj.T > adj) - adj.multiply(adj.T > adj)
-    adj = create_propagator_matrix(adj, device)
-    
-    # print(adj)
+    idx_map = graph["idx_map"]
     
-    propagation_matrix = adj
-    features = features
-    idx_map = idx_map
+    features = identity_features(idx_total, device)  # Drug_ID + Target_ID
+    propagation_matrix = graph["propagation_matrix"]
     
-    split = data_dti.get_split(method = 'random', seed = 42, frac = [0.7, 0.1, 0.2])
+    split = random_split(data_dti, seed = 42, frac = [0.7, 0.1, 0.2])
     df_train =  dti_data_preprocess(split['train'])
     df_val = dti_data_preprocess(split['valid'])
     df_test = dti_data_preprocess(split['test'])
     
-    train_params = {'batch_size': batch_size,
-                        'shuffle': True,
-                        # 'num_workers': 6,
-                        'drop_last': True}
-
-    test_params = {'batch_size': batch_size,
-                    'shuffle': False,
-                    # 'num_workers': 6,
-                    'drop_last': True
-                    }
-
     training_set = Data_DTI(idx_map, df_train.Label.values, df_train)
-    train_loader = data.DataLoader(training_set, **train_params)
+    train_loader = make_loader(training_set, batch_size, train=True)
 
     validation_set = Data_DTI(idx_map, df_val.Label.values, df_val)
-    val_loader = data.DataLoader(validation_set, **test_params)
+    val_loader = make_loader(validation_set, batch_size, train=False)
 
     test_set = Data_DTI(idx_map, df_test.Label.values, df_test)
-    test_loader = data.DataLoader(test_set, **test_params)
+    test_loader = make_loader(test_set, batch_size, train=False)
     
     feature_number = features["dimensions"][1]
     
     model = MixHopNetwork(feature_number)
+    sampler = NeighborSampler(propagation_matrix, feature_number, receptive_field(model), fanouts) if sampled else None
     
-    no_improvement = 0
     optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
-
-    max_auc = 0
+    # early stopping counters live in the checkpointer, so that they survive a resume
+    checkpointer = Checkpointer(model_path+f"checkpoints/hoagcn_{name}/", model, optimizer)
+    start_epoch = 0
+    if resume is not None:
+        start_epoch = checkpointer.resume(None if resume == 'last' else resume)
+        if checkpointer.no_improvement >= early_stopping:
+            start_epoch = epochs
     # loss_history = []
 
     t_total = time.time()
+    loss_recorder = Recorder(csv_path+"hoagcn_loss.csv")
     logger.info('Start Training...')
-    for epoch in range(epochs):
+    for epoch in range(start_epoch, epochs):
         model.train()
         t = time.time()
-        batch_total = len(train_loader)
-        y_pred_train = np.empty([batch_total,batch_size])
-        y_label_train = np.empty([batch_total,batch_size])
-        epoch_loss = 0
-        for i in tqdm(range(batch_total), f"train epoch{epoch + 1}"):
-            label, pairs = next(iter(train_loader))
+        def step(batch):
+            label, pairs = batch
             model.train()
             optimizer.zero_grad()
             label = label.to(device)
             # logger.info(f'pairs:{pairs}')
             # logger.info(f'propagation_matrix:{propagation_matrix}')
             # logger.info(f'features:{features}')
-            prediction, _ = model(propagation_matrix, features, pairs)
+            if sampler is not None:
+                sub_propagation_matrix, sub_features, sub_pairs = sampler.sample(pairs[0], pairs[1], device)
+                prediction, _ = model(sub_propagation_matrix, sub_features, sub_pairs)
+            else:
+                prediction, _ = model(propagation_matrix, features, pairs)
             loss = torch.nn.functional.binary_cross_entropy_with_logits(prediction.squeeze(), label.float())
             # logger.info(f"prediction.squeeze():{prediction.squeeze()}")
             # logger.info(f'label.float():{label.float()}')
             loss.backward()
             optimizer.step()
-            epoch_loss += loss.item()
-            
-            csv_record(csv_path+"hoagcn_loss.csv",{'epoch':epoch, 'batch':i, 'loss':loss.item(), 'avg_loss':epoch_loss/(i+1)})
-
-            y_label_train[i] =  label.flatten().numpy()
-            y_pred_train[i] =  prediction.detach().flatten().numpy()
-        y_label_train = y_label_train.flatten()
-        y_pred_train = y_pred_train.flatten()
-        logger.info(f"y_label_train:{y_label_train}")
-        logger.info(f"y_pred_train:{y_pred_train}")
-        logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(i + 1) + '/' +
-                        str(len(train_loader)) + ' Training loss: ' + str(loss.cpu().detach().numpy()))
-        roc_train = roc_auc_score(y_label_train, y_pred_train)
+            return loss, prediction, label
+        train_result = train_epoch(train_loader, step, f"train epoch{epoch + 1}", loss_recorder, epoch, checkpointer)
+        y_label_train = train_result['y_label']
+        y_pred_train = train_result['y_pred']
+        log_array('y_label_train', y_label_train)
+        log_array('y_pred_train', y_pred_train)
+        logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(len(train_loader)) + '/' +
+                        str(len(train_loader)) + ' Training loss: ' + str(train_result['epoch_loss']))
+        roc_train = auroc(y_label_train, y_pred_train)
 
         # validation after each epoch
-        result = calc_score(model, val_loader,batch_size, propagation_matrix, features)
+        result = calc_score(model, val_loader,batch_size, propagation_matrix, features, sampler)
         result['epoch'] = epoch
-        result['epoch_loss'] = epoch_loss/batch_total
+        result['epoch_loss'] = train_result['epoch_loss']
         csv_record(csv_path+"hoagcn_val_metrics.csv",result)
         logger.info(f'Train: {result}')
         roc_val,prc_val, f1_val = result['auroc'],result['auprc'],result['f1']
-        if roc_val > max_auc:
-            max_auc = roc_val
-            no_improvement = 0
-        else:
-            no_improvement = no_improvement + 1
-            if no_improvement == early_stopping:
-                break
+        checkpointer.observe(roc_val, epoch)
+        checkpointer.save(epoch)
+        if checkpointer.no_improvement == early_stopping:
+            break
 
         logger.info('epoch: {:04d}, '.format(epoch + 1)+
-                'loss_train: {:.4f}, '.format(loss.item())+
+                'loss_train: {:.4f}, '.format(train_result['epoch_loss'])+
                 'auroc_train: {:.4f}, '.format(roc_train)+
                 'auroc_val: {:.4f}, '.format(roc_val)+
                 'auprc_val: {:.4f}, '.format(prc_val)+
                 'f1_val: {:.4f}, '.format(f1_val)+
+                'train: {:.1f} samples/s, '.format(train_result['samples_per_sec'])+
                 'time: {:.4f}s'.format(time.time() - t))
 
+    loss_recorder.close()
     logger.info("Optimization Finished!")
     logger.info("Total time elapsed: {:.4f}s".format(time.time() - t_total))
 
+    # the model of the best validation epoch is the one kept
+    checkpointer.restore_best()
+    checkpointer.close()
     # sava model
     save_model(model, model_path+f"hoagcn_{name}_epoch{epochs}.pt")
     
     # Testing
-    result = calc_score(model, test_loader, batch_size, propagation_matrix, features)
+    result = calc_score(model, test_loader, batch_size, propagation_matrix, features, sampler)
     csv_record(csv_path+"hoagcn_test_metrics.csv",result)
     print(f'Test: {result}')
     logger.remove(log_fd)
+    return result
 
 
 
@@ -527,5 +554,10 @@ if __name__ == '__main__':
     # train('BindingDB_Kd')
     # train('BindingDB_IC50')
     # train('BindingDB_Ki')
-    train('DAVIS')
+    parser = argparse.ArgumentParser(description="Training HOAGCN")
+    parser.add_argument('--dataset', default='DAVIS')
+    parser.add_argument('--resume', nargs='?', const='last', default=None,
+                        help="resume training from a checkpoint (default: the latest one of the dataset)")
+    args = parser.parse_args()
+    train(args.dataset, resume=args.resume)
     # train('KIBA')
\ No newline at end of file
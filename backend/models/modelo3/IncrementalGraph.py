@@ -0,0 +1,164 @@
+import numpy as np
+import torch
+from loguru import logger
+
+from Utils import identity_features
+
+class IncrementalGraph:
+    """
+    Drug-target graph that accepts new nodes and interactions without rebuilding the propagator.
+    The normalized propagator D^-1/2 (A + 2I) D^-1/2 (A binary, as built by GraphBuilder) is kept
+    in COO arrays; adding an edge only changes the degrees of its two ends, so only the entries in
+    their rows and columns are renormalized.
+    :param idx: Node IDs; the position is the node index.
+    :param indptr, indices, values: CSR arrays of the normalized propagator (GraphBuilder.normalized_adjacency).
+    """
+    def __init__(self, idx, indptr, indices, values):
+        self.idx = list(idx)
+        self.idx_map = {j: i for i, j in enumerate(self.idx)}
+        size = len(indices)
+        rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        cols = np.asarray(indices, dtype=np.int64)
+        capacity = max(2 * size, 1024)
+        self.rows = np.empty(capacity, dtype=np.int64)
+        self.cols = np.empty(capacity, dtype=np.int64)
+        self.raw = np.empty(capacity, dtype=np.float64)
+        self.vals = np.empty(capacity, dtype=np.float32)
+        self.rows[:size], self.cols[:size] = rows, cols
+        self.raw[:size] = np.where(rows == cols, 2.0, 1.0)
+        self.vals[:size] = values
+        self.size = size
+        # degree of A + 2I: neighbours + 2 (each row holds its neighbours and the diagonal)
+        self.degrees = np.diff(indptr).astype(np.float64) + 1
+        self.entries = {(int(i), int(j)): p for p, (i, j) in enumerate(zip(rows, cols))}
+        self.row_positions = [list(range(indptr[i], indptr[i + 1])) for i in range(len(self.idx))]
+
+    def __len__(self):
+        return len(self.idx)
+
+    def _renormalize(self, positions):
+        dinv = np.power(self.degrees, -0.5)
+        self.vals[positions] = self.raw[positions] * dinv[self.rows[positions]] * dinv[self.cols[positions]]
+
+    def _append(self, i, j, value):
+        if self.size == len(self.rows):
+            for name in ("rows", "cols", "raw", "vals"):
+                old = getattr(self, name)
+                new = np.empty(2 * len(old), dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        p = self.size
+        self.rows[p], self.cols[p], self.raw[p] = i, j, value
+        self.entries[(i, j)] = p
+        self.row_positions[i].append(p)
+        self.size += 1
+        return p
+
+    def neighbours(self, i):
+        return [int(self.cols[p]) for p in self.row_positions[i] if self.cols[p] != i]
+
+    def add_nodes(self, ids):
+        """
+        Appending nodes (new drugs or targets). Already known IDs are ignored.
+        :return new: Indices of the nodes that were added.
+        """
+        new = []
+        for node_id in ids:
+            if node_id in self.idx_map:
+                continue
+            i = len(self.idx)
+            self.idx.append(node_id)
+            self.idx_map[node_id] = i
+            self.row_positions.append([])
+            self.degrees = np.append(self.degrees, 2.0)
+            p = self._append(i, i, 2.0)
+            self._renormalize(np.array([p]))
+            new.append(i)
+        return new
+
+    def add_edges(self, pairs):
+        """
+        Adding interactions between known node IDs and renormalizing the affected entries only.
+        :param pairs: Iterable of (drug_id, target_id).
+        :return changed: Indices of the nodes whose degree changed.
+        """
+        changed = set()
+        for drug_id, target_id in pairs:
+            u, v = self.idx_map[drug_id], self.idx_map[target_id]
+            if u == v or (u, v) in self.entries:
+                # A is binary: an already known interaction changes nothing
+                continue
+            self._append(u, v, 1.0)
+            self._append(v, u, 1.0)
+            self.degrees[u] += 1.0
+            self.degrees[v] += 1.0
+            changed.update((u, v))
+        positions = set()
+        for u in changed:
+            for p in self.row_positions[u]:
+                positions.add(p)
+                positions.add(self.entries[(int(self.cols[p]), u)])
+        if positions:
+            self._renormalize(np.fromiter(positions, dtype=np.int64))
+        return sorted(changed)
+
+    def propagator(self, device=torch.device('cpu')):
+        """Propagation matrix of the whole graph, in the format of create_propagator_matrix."""
+        propagation_matrix = dict()
+        propagation_matrix["indices"] = torch.LongTensor(np.vstack((self.rows[:self.size], self.cols[:self.size]))).to(device)
+        propagation_matrix["values"] = torch.FloatTensor(self.vals[:self.size]).to(device)
+        return propagation_matrix
+
+    def k_hop(self, nodes, hops):
+        """Nodes within hops of the given nodes (included)."""
+        region = set(nodes)
+        frontier = set(nodes)
+        for _ in range(hops):
+            frontier = {j for i in frontier for j in self.neighbours(i)} - region
+            if not frontier:
+                break
+            region |= frontier
+        return region
+
+    def subgraph(self, nodes, device=torch.device('cpu')):
+        """
+        Propagator restricted to a set of nodes (global normalization) and their identity features.
+        :return propagation_matrix, features, nodes: nodes is the sorted array of global indices.
+        """
+        nodes = np.array(sorted(nodes), dtype=np.int64)
+        local = {int(i): k for k, i in enumerate(nodes)}
+        positions = np.array([p for i in nodes for p in self.row_positions[i] if int(self.cols[p]) in local], dtype=np.int64)
+        propagation_matrix = dict()
+        rows = np.array([local[int(i)] for i in self.rows[positions]], dtype=np.int64)
+        cols = np.array([local[int(j)] for j in self.cols[positions]], dtype=np.int64)
+        propagation_matrix["indices"] = torch.LongTensor(np.vstack((rows, cols))).to(device)
+        propagation_matrix["values"] = torch.FloatTensor(self.vals[positions]).to(device)
+        features = identity_features(len(nodes), device)
+        features["node_ids"] = torch.LongTensor(nodes).to(device)
+        return propagation_matrix, features, nodes
+
+    @torch.no_grad()
+    def refresh_embeddings(self, model, latent_features, changed, hops, device=torch.device('cpu')):
+        """
+        Updating cached latent features after a change. Only the nodes within hops of the changed
+        nodes can change; they are recomputed exactly on their hops-neighbourhood.
+        :param model: MixHopNetwork in eval mode.
+        :param latent_features: Cached latent features (rows for the nodes known before the update).
+        :param changed: Nodes whose degree changed or that were added.
+        :param hops: Receptive field of the model.
+        :return latent_features: Latent features for every node of the graph.
+        """
+        if len(latent_features) < len(self):
+            pad = latent_features.new_zeros(len(self) - len(latent_features), latent_features.shape[1])
+            latent_features = torch.cat((latent_features, pad))
+        if not changed:
+            return latent_features
+        region = self.k_hop(changed, hops)
+        support = self.k_hop(region, hops)
+        propagation_matrix, features, nodes = self.subgraph(support, device)
+        sub_latent = model.embed(propagation_matrix, features)
+        region = np.array(sorted(region), dtype=np.int64)
+        latent_features = latent_features.clone()
+        latent_features[torch.LongTensor(region)] = sub_latent[torch.LongTensor(np.searchsorted(nodes, region))]
+        logger.info(f"refreshed {len(region)} latent features on a {len(nodes)}-node subgraph")
+        return latent_features
@@ -1,5 +1,6 @@
 import os
 import time
+import argparse
 import datetime
 import random
 
@@ -19,7 +20,6 @@ import pandas as pd
 from tqdm import tqdm
 from loguru import logger
 import pandas as pd
-from tdc.multi_pred import DTI
 
 from DeepPurpose import utils, dataset
 from DeepPurpose import DTI as models
@@ -27,8 +27,18 @@ from DeepPurpose import DTI as models
 # from DeepPurpose.dataset import *
 
 from HOAGCN import MixHopNetwork
+from Subgraph import NeighborSampler, receptive_field
+from Engine import make_loader, train_epoch, evaluate
+from Recorder import Recorder, log_array
+from Datasets import DTI_Dataset
+from EncodingCache import encode_drug, encode_protein
+from NegativeSampling import oversample_negatives
+from GraphBuilder import build_graph, save_propagator
+from DatasetStore import load_dataset, BINARIZATION
+from Checkpoint import Checkpointer
+from Metrics import binary_metrics, auroc
 from HDN import get_model
-from Utils import csv_record,check_dir,save_model,load_model,class_metrics,features_to_sparse,create_propagator_matrix,setup_seed
+from Utils import csv_record,check_dir,save_model,load_model,class_metrics,identity_features,setup_seed,save_graph,BASE_PATH
 
 neg_label = 1
 pos_label = 0
@@ -43,37 +53,29 @@ class MINDG(nn.Module):
         self.features = features
         self.sigmoid = nn.Sigmoid()
         self.softmax = nn.Softmax(dim=-1)
-    def forward(self, v_d, v_p, idx1, idx2):
+    def forward(self, v_d, v_p, idx1, idx2, propagation_matrix=None, features=None):
+        # propagation_matrix/features override the full graph (sampled mini-batch subgraph)
+        propagation_matrix = self.propagation_matrix if propagation_matrix is None else propagation_matrix
+        features = self.features if features is None else features
         pred1 = self.view1_model(v_d, v_p) # sequence
-        pred2,_ = self.view2_model(self.propagation_matrix,self.features, (idx1, idx2)) # graph
+        pred2,_ = self.view2_model(propagation_matrix, features, (idx1, idx2)) # graph
         output = self.alpha * pred1 + (1 - self.alpha)* pred2
         return output
- 
-class DTI_Dataset(data.Dataset):
-    # df : a list of data, which includes an index for the pair, an index for entity1 and entity2, from a list that combines all the entities. we want the
-    def __init__(self, idx_map, df):
-        'Initialization'
-        self.idx_map = idx_map
-        self.df = df
-
-    def __len__(self):
-        'Denotes the total number of samples'
-        return len(self.df)
 
-    def __getitem__(self, index):
-        'Generates one sample of data'
-        # Select sample
-        # Load data and get label
-        idx1 = self.idx_map[str(self.df.iloc[index].Graph_Drug)]
-        idx2 = self.idx_map[self.df.iloc[index].Graph_Target]
-        label = self.df.iloc[index].Graph_Label
-        drug_encoding = self.df.iloc[index].drug_encoding
-        target_encoding = self.df.iloc[index].target_encoding
-        v_d = drug_encoding
-        v_p = utils.protein_2_embed(target_encoding)
-        y = self.df.iloc[index].Seq_Label
-        return v_d, v_p , y, idx1, idx2,label
+    def embed(self):
+        """
+        Latent node features of the graph view. They only depend on the graph, not on the pair,
+        so at inference time they can be computed once and reused for every request.
+        """
+        return self.view2_model.embed(self.propagation_matrix, self.features)
 
+    def forward_cached(self, v_d, v_p, latent_features, idx1, idx2):
+        """Same as forward but scoring the graph view on precomputed latent features."""
+        pred1 = self.view1_model(v_d, v_p) # sequence
+        pred2 = self.view2_model.score(latent_features, (idx1, idx2)) # graph
+        output = self.alpha * pred1 + (1 - self.alpha)* pred2
+        return output
+ 
 def get_threshold(label, pred):
     df_pred = pd.DataFrame(pred, columns=['pred'])
     df_pred = df_pred.sort_values(by=['pred'])
@@ -85,40 +87,29 @@ def get_threshold(label, pred):
     logger.info(f'threshold:{threshold}')
     return threshold
     
-def calc_score(model, data_loader,batch_size):
+def calc_score(model, data_loader,batch_size, sampler=None):
     with torch.no_grad():
         model.eval()
-        batch_total = len(data_loader)
-        y_pred = np.empty([batch_total,batch_size])
-        y_label = np.empty([batch_total,batch_size])
-        for i in tqdm(range(batch_total), 'metrics'):
-            v_d, v_p, y,idx_1,idx_2,label  = next(iter(data_loader))
-            pred = model(v_d, v_p, idx_1,idx_2)
-            label_ids = y.numpy()
-            y_label[i] = label_ids
-            y_pred[i] = pred.flatten().detach().numpy()
-        y_pred = y_pred.flatten()
-        y_label = y_label.flatten()
+        if sampler is not None:
+            # mini-batch mode: the graph view of every batch runs on its sampled subgraph, never on the whole graph
+            rng = sampler.eval_rng()
+            device = model.propagation_matrix["indices"].device
+            def predict(batch):
+                v_d, v_p, y,idx_1,idx_2,label = batch
+                sub_propagation_matrix, sub_features, (sub_idx_1, sub_idx_2) = sampler.sample(idx_1, idx_2, device, rng)
+                return model(v_d, v_p, sub_idx_1, sub_idx_2, sub_propagation_matrix, sub_features), y
+        else:
+            # eval mode is deterministic: the graph view is embedded once for all batches
+            latent_features = model.embed()
+            def predict(batch):
+                v_d, v_p, y,idx_1,idx_2,label = batch
+                return model.forward_cached(v_d, v_p, latent_features, idx_1,idx_2), y
+        scores = evaluate(data_loader, predict)
+        y_pred = scores['y_pred']
+        y_label = scores['y_label']
         threshold = 0.5 #get_threshold(y_label, y_pred)  #0.5
-        y_pred_binary = np.empty(batch_total*batch_size)
-        for i in range(len(y_pred_binary)):
-            if y_pred[i] >  threshold:  # 
-                y_pred_binary[i] = neg_label
-            else:
-                y_pred_binary[i] = pos_label
-        auprc = average_precision_score(y_label, y_pred)
-        # auprc = my_auprc(y_label, y_pred)
-        auroc = roc_auc_score(y_label, y_pred)
-        logger.info(f'y_label: {y_label}')
-        logger.info(f'y_pred: {y_pred}')
-        # f1 = f1_score(y_label, y_pred_binary)
-        # recall  = recall_score(y_label, y_pred_binary)
-        # sensitivity = recall
-        # precision = precision_score(y_label, y_pred_binary)
-        # accuracy = accuracy_score(y_label, y_pred_binary)
-        result = class_metrics(y_label, y_pred_binary)
-        result['auprc'] = auprc
-        result['auroc'] = auroc
+        result = binary_metrics(y_label, y_pred, threshold, pos_label, neg_label)
+        result['samples_per_sec'] = scores['samples_per_sec']
         # result['auc'] = auc_cindex
         return result
 
@@ -130,41 +121,8 @@ def sample_stat(df):
     logger.info(f'neg/pos:{neg_label_num}/{pos_label_num}, neg:{neg_label_num * 100 //(neg_label_num + pos_label_num)}%, pos:{pos_label_num * 100 //(neg_label_num + pos_label_num)}%')
     return neg_label_num, pos_label_num
 
-def find_unobserved_pair(df, drug_ids, target_ids):
-    while(1):
-        drug_id = random.sample(drug_ids, 1)[0]
-        target_id = random.sample(target_ids, 1)[0]
-        dfA = df[df.Drug_ID == drug_id]
-        if target_id not in dfA["Target_ID"].values:
-            break
-    return drug_id, target_id
-    
-
 def get_unobserved_negative_samples(df):
-    neg_samples = df[df.Label == neg_label]
-    pos_samples =  df[df.Label == pos_label]
-    neg_label_num = neg_samples.shape[0]
-    pos_label_num = pos_samples.shape[0]
-    delta = pos_label_num - neg_label_num
-    drug_dict = {}
-    target_dict = {}
-    drug_ids = list(df['Drug_ID'].unique())
-    target_ids = list(df['Target_ID'].unique())
-    if len(drug_ids)*len(target_ids) < delta + pos_label_num + neg_label_num:
-        iter_num = pos_label_num // neg_label_num
-        for _ in range(iter_num):
-            df = df.append(neg_samples, ignore_index=True)
-    else:
-        for id in tqdm(drug_ids, "drug dict"):
-            drug = df[df.Drug_ID == id].Drug.values[0]
-            drug_dict[id] = drug
-        for id in tqdm(target_ids, "target dict"):
-            target = df[df.Target_ID == id].Target.values[0]
-            target_dict[id] = target
-        for _ in tqdm(range(delta), "oversampling"):
-            drug_id, target_id = find_unobserved_pair(df, drug_ids, target_ids)
-            row = [drug_id, drug_dict[drug_id], target_id, target_dict[target_id], neg_label]
-            df = df.append(pd.Series(row, index=df.columns), ignore_index=True)
+    df = oversample_negatives(df, neg_label, pos_label)
     sample_stat(df)
     return df
 
@@ -176,14 +134,13 @@ def df_data_preprocess(df, oversampling=False, undersampling=True):
     if oversampling:
         logger.info('oversampling')
         pos_samples = df[df.Label == pos_label]
-        for _ in range(1):
-            df = df.append(pos_samples,ignore_index=True)
+        df = pd.concat([df, pos_samples], ignore_index=True)
         # df = get_unobserved_negative_samples(df)
     if undersampling:
         logger.info('undersampling')
         neg_samples = df[df.Label == neg_label][:pos_label_num]
         pos_samples = df[df.Label == pos_label]
-        df = pos_samples.append(neg_samples, ignore_index=True)
+        df = pd.concat([pos_samples, neg_samples], ignore_index=True)
     sample_stat(df)
     return df
 
@@ -218,20 +175,22 @@ def dti_df_process(df):
                         5:'Graph_Label'}, 
                             inplace=True)
     drug_encoding, target_encoding = 'MPNN', 'CNN'
-    df = utils.encode_drug(df, drug_encoding, column_name='Seq_Drug')
-    df = utils.encode_protein(df, target_encoding, column_name='Seq_Target')
+    # cached across splits and runs, each distinct drug/protein is only encoded once
+    df = encode_drug(df, drug_encoding, column_name='Seq_Drug')
+    df = encode_protein(df, target_encoding, column_name='Seq_Target')
     return df
 
-def run(name, phase="train",batch_size=32,epochs=5,learning_rate=5e-4,lr_step_size=10,early_stopping=10,device=torch.device('cpu'),seed_id=10):
-    batch_size = 32
-    epochs = 5# 5 10 20
-    learning_rate = 5e-4
-    lr_step_size = 10
-    device = torch.device('cpu')
-    
+def run(name, phase="train",batch_size=32,epochs=5,learning_rate=5e-4,lr_step_size=10,early_stopping=10,device=torch.device('cpu'),seed_id=10,sampled=False,fanouts=None,base_path=BASE_PATH,resume=None):
+    """
+    Training and testing MINDG on a TDC DTI dataset.
+    :param sampled: Mini-batch mode: the graph view propagates over the sampled neighbourhood of each batch only, in training and evaluation.
+    :param fanouts: Neighbours expanded per node at each hop in mini-batch mode (None = all, exact but only bounded by the neighbourhood size).
+    :param base_path: Root of the output/ directory (MODELO3_BASE_PATH by default).
+    :param resume: Checkpoint to resume training from ('last' = latest checkpoint of this dataset).
+    :return result: Test metrics (None if the dataset is not supported).
+    """
     setup_seed(seed_id)
     
-    base_path = "/home/yang/sda/github/MINDG/"
     model_path = base_path+ f"output/model/"
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
     root_path = base_path+f'output/{name}/'+now +'/'
@@ -244,36 +203,23 @@ def run(name, phase="train",batch_size=32,epochs=5,learning_rate=5e-4,lr_step_si
     log_fd = logger.add(log_path+"/train.log")
     
     # generate ID map
-    data_dti = DTI(name = name)
-    if name in "DAVIS":
-        data_dti.convert_to_log(form = 'binding')
-        data_dti.binarize(threshold = 7, order = 'descending') # 7
-    elif name == "BindingDB_Kd":
-        data_dti.convert_to_log(form = 'binding')
-        data_dti.binarize(threshold = 7.6, order = 'descending') #7.6
-    elif name == "KIBA":
-        data_dti.binarize(threshold = 12.1, order = 'descending')
-    else:
+    if name not in BINARIZATION:
         logger.error(f"dataset {name} is not supported")
         return
-    df = data_dti.get_data()
+    # converted and binarized once, read from the local store (DatasetStore)
+    df = load_dataset(name, binarized=True)
     df = df_data_preprocess(df)
     logger.info(f"{name}: \n{df.head(5)}")
-    idx = np.concatenate((df['Drug_ID'].unique(), df['Target_ID'].unique()))
-    idx_map = {j: i for i, j in enumerate(idx)}
-    
-    edges_unordered = df[['Drug_ID', 'Target_ID']].values
+    graph = build_graph(df, device)
+    idx = graph["idx"]
+    idx_map = graph["idx_map"]
+    edges = graph["edges"]
     idx_total = len(idx)
-    features = np.eye(idx_total)  # Drug_ID + Target_ID
-    features = features_to_sparse(features, device)
-    edges = np.array(list(map(idx_map.get, edges_unordered.flatten()))).reshape(edges_unordered.shape)
-    adj = sp.coo_matrix((np.ones(edges.shape[0]), (edges[:, 0], edges[:, 1])),
-                        shape=(len(idx), len(idx)),
-                        dtype=np.float32)
-    # build symmetric adjacency matrix
-    adj = adj + adj.T.multiply(adj.T > adj) - adj.multiply(adj.T > adj)
-    adj = create_propagator_matrix(adj, device)
-    propagation_matrix = adj
+    features = identity_features(idx_total, device)  # Drug_ID + Target_ID
+    propagation_matrix = graph["propagation_matrix"]
+    save_graph(model_path+f"graph_{name}/", idx, graph["n_drugs"], edges,
+               dict(zip(df.Drug, df.Drug_ID)), dict(zip(df.Target, df.Target_ID)))
+    save_propagator(model_path+f"graph_{name}/", *graph["csr"])
     
     # train/valid/test dataframe
     df_train, df_valid, df_test = df_data_split(df)
@@ -285,28 +231,14 @@ def run(name, phase="train",batch_size=32,epochs=5,learning_rate=5e-4,lr_step_si
     logger.info(f'test: {df_test.shape}')
     logger.info(f'df_train: \n {df_train.head(5)}')
     
-    train_params = {'batch_size': batch_size,
-                    'shuffle': True,
-                    # 'num_workers': 6,
-                    'drop_last': True,
-                    'collate_fn': utils.mpnn_collate_func
-                    }
-
-    test_params = {'batch_size': batch_size,
-                    'shuffle': False,
-                    # 'num_workers': 6,
-                    'drop_last': True,
-                    'collate_fn': utils.mpnn_collate_func
-                    }
-
     train_dataset = DTI_Dataset(idx_map, df_train)
-    train_loader = data.DataLoader(train_dataset, **train_params)
+    train_loader = make_loader(train_dataset, batch_size, train=True, collate_fn=utils.mpnn_collate_func)
 
     valid_dataset = DTI_Dataset(idx_map, df_valid)
-    valid_loader = data.DataLoader(valid_dataset, **test_params)
+    valid_loader = make_loader(valid_dataset, batch_size, train=False, collate_fn=utils.mpnn_collate_func)
 
     test_dataset = DTI_Dataset(idx_map, df_test)
-    test_loader = data.DataLoader(test_dataset, **test_params)
+    test_loader = make_loader(test_dataset, batch_size, train=False, collate_fn=utils.mpnn_collate_func)
     
     
     hdn_model = get_model().model
@@ -314,70 +246,92 @@ def run(name, phase="train",batch_size=32,epochs=5,learning_rate=5e-4,lr_step_si
     hoagcn_model = MixHopNetwork(feature_number)
     
     mindg_model = MINDG(hdn_model, hoagcn_model, propagation_matrix, features)
-    if phase=='train' or not os.path.exists(model_path+f"mindg_{name}_epoch{epochs}.pt"):
+    sampler = NeighborSampler(propagation_matrix, idx_total, receptive_field(hoagcn_model), fanouts, seed_id) if sampled else None
+    if phase=='train' or resume is not None or not os.path.exists(model_path+f"mindg_{name}_epoch{epochs}.pt"):
         optimizer = torch.optim.Adam(mindg_model.parameters(), lr = learning_rate)
         scheduler = lr_scheduler.StepLR(optimizer, step_size=lr_step_size, gamma=0.1)
+        checkpointer = Checkpointer(model_path+f"checkpoints/mindg_{name}/", mindg_model, optimizer, scheduler)
+        start_epoch = 0
+        if resume is not None:
+            start_epoch = checkpointer.resume(None if resume == 'last' else resume)
+            if checkpointer.no_improvement >= early_stopping:
+                start_epoch = epochs
         logger.info('Start Training...')
+        loss_recorder = Recorder(csv_path+"mindg_loss.csv")
         t_total = time.time()
-        for epoch in range(epochs):
+        for epoch in range(start_epoch, epochs):
             t = time.time()
-            epoch_loss = 0
-            batch_total = len(train_loader)
-            y_pred_train = np.empty([batch_total,batch_size])
-            y_label_train = np.empty([batch_total,batch_size])
-            for i in tqdm(range(batch_total), f"train epoch{epoch + 1}"):
-                v_d, v_p, y,idx_1,idx_2,label = next(iter(train_loader))
+            mindg_model.train()
+            def step(batch):
+                v_d, v_p, y,idx_1,idx_2,label = batch
                 optimizer.zero_grad()
-                pred = mindg_model( v_d, v_p, idx_1,idx_2)
+                if sampler is not None:
+                    sub_propagation_matrix, sub_features, (sub_idx_1, sub_idx_2) = sampler.sample(idx_1, idx_2, device)
+                    pred = mindg_model(v_d, v_p, sub_idx_1, sub_idx_2, sub_propagation_matrix, sub_features)
+                else:
+                    pred = mindg_model( v_d, v_p, idx_1,idx_2)
                 pred = pred.flatten()
                 label = y.float()
                 loss = torch.nn.functional.binary_cross_entropy_with_logits(pred, label)
                 loss.backward()
                 optimizer.step()
-                epoch_loss += loss.item()
-                csv_record(csv_path+"mindg_loss.csv",{'epoch':epoch+1, 'batch':i, 'loss':loss.item(), 'avg_loss':epoch_loss/(i+1)})
-                y_label_train[i] =  label.flatten().numpy()
-                y_pred_train[i] =  pred.detach().flatten().numpy()
+                return loss, pred, label
+            train_result = train_epoch(train_loader, step, f"train epoch{epoch + 1}", loss_recorder, epoch, checkpointer)
             scheduler.step()
-            y_label_train = y_label_train.flatten()
-            y_pred_train = y_pred_train.flatten()
-            logger.info(f'y_label_train:{y_label_train}')
-            logger.info(f'y_pred_train:{y_pred_train}')
-            logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(i + 1) + '/' +
-                            str(len(train_loader)) + ' Training loss: ' + str(loss.cpu().detach().numpy()))
-            roc_train = roc_auc_score(y_label_train, y_pred_train)
+            y_label_train = train_result['y_label']
+            y_pred_train = train_result['y_pred']
+            log_array('y_label_train', y_label_train)
+            log_array('y_pred_train', y_pred_train)
+            logger.info('Epoch: ' + str(epoch + 1) + '/' + str(epochs) + ' Iteration: ' + str(len(train_loader)) + '/' +
+                            str(len(train_loader)) + ' Training loss: ' + str(train_result['epoch_loss']))
+            roc_train = auroc(y_label_train, y_pred_train)
             # validation after each epoch
-            result = calc_score(mindg_model, valid_loader,batch_size)
+            result = calc_score(mindg_model, valid_loader,batch_size, sampler)
             result['epoch'] = epoch +1
-            result['epoch_loss'] = epoch_loss/batch_total
+            result['epoch_loss'] = train_result['epoch_loss']
             result['lr'] = optimizer.state_dict()['param_groups'][0]['lr']
             csv_record(csv_path+"mindg_val_metrics.csv",result)
             logger.info(f'Train: {result}')
             roc_val,prc_val, f1_val = result['auroc'],result['auprc'],result['f1']
+            checkpointer.observe(roc_val, epoch)
+            checkpointer.save(epoch)
+            if checkpointer.no_improvement == early_stopping:
+                break
 
             logger.info('epoch: {:04d}, '.format(epoch + 1)+
                     'auroc_train: {:.4f}, '.format(roc_train)+
                     'auroc_val: {:.4f}, '.format(roc_val)+
                     'auprc_val: {:.4f}, '.format(prc_val)+
                     'f1_val: {:.4f}, '.format(f1_val)+
+                    'train: {:.1f} samples/s, '.format(train_result['samples_per_sec'])+
                     'time: {:.4f}s'.format(time.time() - t))
 
+        loss_recorder.close()
         logger.info("Optimization Finished!")
         logger.info("Total time elapsed: {:.4f}s".format(time.time() - t_total))
 
+        # the model of the best validation epoch is the one kept
+        checkpointer.restore_best()
+        checkpointer.close()
         # sava model
         save_model(mindg_model, model_path+f"mindg_{name}_epoch{epochs}.pt")
     
     # Testing
     load_model(mindg_model, model_path+f"mindg_{name}_epoch{epochs}.pt")
-    result = calc_score(mindg_model, test_loader, batch_size)
+    result = calc_score(mindg_model, test_loader, batch_size, sampler)
     csv_record(csv_path+"mindg_test_metrics.csv",result)
     print(f'Test: {result}')
     logger.remove(log_fd)
+    return result
 
 
 if __name__ == '__main__':
-    run('DAVIS')
+    parser = argparse.ArgumentParser(description="Training and testing MINDG")
+    parser.add_argument('--dataset', default='DAVIS')
+    parser.add_argument('--resume', nargs='?', const='last', default=None,
+                        help="resume training from a checkpoint (default: the latest one of the dataset)")
+    args = parser.parse_args()
+    run(args.dataset, resume=args.resume)
     # run('BindingDB_Kd')
     # run('KIBA')
     # run('BindingDB_IC50')
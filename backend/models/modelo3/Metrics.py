@@ -0,0 +1,173 @@
+import numpy as np
+
+def confusion_counts(y_label, y_pred, pos_label=0, neg_label=1):
+    """
+    TP, TN, FP and FN of binary predictions. The positive class is pos_label (0 in this repo:
+    binding pairs), as in Utils.class_metrics.
+    """
+    y_label = np.asarray(y_label)
+    y_pred = np.asarray(y_pred)
+    pred_pos = y_pred == pos_label
+    pred_neg = y_pred == neg_label
+    label_pos = y_label == pos_label
+    label_neg = y_label == neg_label
+    TP = int(np.count_nonzero(pred_pos & label_pos))
+    FP = int(np.count_nonzero(pred_pos & label_neg))
+    TN = int(np.count_nonzero(pred_neg & label_neg))
+    FN = int(np.count_nonzero(pred_neg & label_pos))
+    return TP, TN, FP, FN
+
+def confusion_metrics(TP, TN, FP, FN):
+    """Sensitivity, specificity, recall, precision, accuracy and F1 of confusion counts (1.0 when undefined)."""
+    sensitivity = TP / (TP + FN) if (TP + FN) else 1.0
+    specificity = TN / (FP + TN) if (FP + TN) else 1.0
+    precision = TP / (TP + FP) if (TP + FP) else 1.0
+    total = TP + TN + FP + FN
+    accuracy = (TP + TN) / total if total else 1.0
+    f1 = 2*TP / (2*TP + FN + FP) if (2*TP + FN + FP) else 1.0
+    return {"sensitivity": sensitivity, "specificity": specificity,
+            "recall": sensitivity, "precision": precision, "accuracy": accuracy,
+            "f1": f1}
+
+def ranking_curve(y_label, y_score):
+    """
+    True and false positive counts at every distinct score threshold, highest scores first.
+    The positive class is label 1 (sklearn's convention for roc_auc_score/average_precision_score).
+    """
+    if len(y_score) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order = np.argsort(-np.asarray(y_score), kind='mergesort')
+    score = np.asarray(y_score)[order]
+    label = (np.asarray(y_label)[order] == 1).astype(np.int64)
+    distinct = np.r_[np.nonzero(np.diff(score))[0], len(score) - 1]
+    tps = np.cumsum(label)[distinct]
+    fps = (distinct + 1) - tps
+    return tps, fps
+
+def auroc(y_label, y_score):
+    """Area under the ROC curve, same value as sklearn.metrics.roc_auc_score."""
+    tps, fps = ranking_curve(y_label, y_score)
+    if len(tps) == 0 or tps[-1] == 0 or fps[-1] == 0:
+        return float('nan')
+    tpr = np.r_[0, tps] / tps[-1]
+    fpr = np.r_[0, fps] / fps[-1]
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+def auprc(y_label, y_score):
+    """Average precision, same value as sklearn.metrics.average_precision_score."""
+    tps, fps = ranking_curve(y_label, y_score)
+    if len(tps) == 0 or tps[-1] == 0:
+        return float('nan')
+    precision = tps / (tps + fps)
+    recall = tps / tps[-1]
+    return float(np.sum(np.diff(np.r_[0, recall]) * precision))
+
+class ScoreAccumulator:
+    """
+    Streaming collection of labels and scores, batch by batch, into growing preallocated buffers.
+    The ranking metrics are computed once at the end with a single sort (O(n log n)).
+    """
+    def __init__(self, capacity=1024):
+        self.labels = np.empty(capacity, dtype=np.float64)
+        self.scores = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def update(self, y_label, y_score):
+        y_label = np.asarray(y_label, dtype=np.float64).ravel()
+        y_score = np.asarray(y_score, dtype=np.float64).ravel()
+        end = self.size + len(y_label)
+        if end > len(self.labels):
+            capacity = max(end, 2 * len(self.labels))
+            self.labels = np.resize(self.labels, capacity)
+            self.scores = np.resize(self.scores, capacity)
+        self.labels[self.size:end] = y_label
+        self.scores[self.size:end] = y_score
+        self.size = end
+
+    @property
+    def y_label(self):
+        return self.labels[:self.size]
+
+    @property
+    def y_score(self):
+        return self.scores[:self.size]
+
+    def auroc(self):
+        return auroc(self.y_label, self.y_score)
+
+    def auprc(self):
+        return auprc(self.y_label, self.y_score)
+
+def binary_metrics(y_label, y_score, threshold=0.5, pos_label=0, neg_label=1):
+    """
+    Confusion-based metrics of the thresholded scores (score > threshold -> neg_label) plus AUROC and AUPRC.
+    """
+    y_score = np.asarray(y_score)
+    y_pred = np.where(y_score > threshold, neg_label, pos_label)
+    result = confusion_metrics(*confusion_counts(y_label, y_pred, pos_label, neg_label))
+    result['auprc'] = auprc(y_label, y_score)
+    result['auroc'] = auroc(y_label, y_score)
+    result['cindex'] = concordance_index(y_label, y_score)
+    return result
+
+def _increasing_pairs(ranks):
+    """
+    Number of index pairs i < j with ranks[i] < ranks[j] (ranks are integers in [0, n)).
+    Radix counting from the most significant bit: at bit b, a pair is counted when both ranks share
+    the higher bits and ranks[i] has a 0 where ranks[j] has a 1. Inside each group of equal higher
+    bits the elements are kept in index order, and the group is split stably on bit b for the next
+    level, so every level is O(n) and the whole count O(n log n).
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    n = len(ranks)
+    if n < 2:
+        return 0
+    count = 0
+    order = np.arange(n)
+    positions = np.arange(n)
+    for b in range(max(1, int(ranks.max()).bit_length()) - 1, -1, -1):
+        seq = ranks[order]
+        bit = (seq >> b) & 1
+        high = seq >> (b + 1)
+        starts = np.r_[0, np.nonzero(np.diff(high))[0] + 1]
+        start = np.repeat(starts, np.diff(np.r_[starts, n]))
+        ones_before = np.cumsum(bit) - bit
+        ones_before -= ones_before[start]
+        zeros_before = positions - start - ones_before
+        count += int(zeros_before[bit == 1].sum())
+        group_zeros = np.repeat(np.add.reduceat(1 - bit, starts), np.diff(np.r_[starts, n]))
+        new_positions = np.where(bit == 0, start + zeros_before, start + group_zeros + ones_before)
+        new_order = np.empty(n, dtype=np.int64)
+        new_order[new_positions] = order
+        order = new_order
+    return count
+
+def _tied_pairs(*columns):
+    """Number of pairs with equal values in all the columns."""
+    order = np.lexsort(columns)
+    sorted_columns = np.stack([np.asarray(c)[order] for c in columns])
+    boundaries = np.r_[0, np.nonzero(np.any(np.diff(sorted_columns, axis=1) != 0, axis=0))[0] + 1, len(order)]
+    counts = np.diff(boundaries)
+    return int((counts * (counts - 1) // 2).sum())
+
+def concordance_index(y_true, y_pred):
+    """
+    Concordance index: over the pairs with different true values, the fraction ordered the same
+    way by the predictions, prediction ties counting 1/2 (the pairwise definition), in O(n log n).
+    """
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    y_pred = np.asarray(y_pred, dtype=np.float64).ravel()
+    n = len(y_true)
+    comparable = n * (n - 1) // 2 - _tied_pairs(y_true)
+    if comparable == 0:
+        return float('nan')
+    # increasing true value, and decreasing prediction inside equal true values so that those
+    # pairs are never counted as concordant
+    order = np.lexsort((-y_pred, y_true))
+    ranks = np.unique(y_pred, return_inverse=True)[1].ravel()[order]
+    concordant = _increasing_pairs(ranks)
+    ties = _tied_pairs(y_pred) - _tied_pairs(y_true, y_pred)
+    return (concordant + 0.5 * ties) / comparable
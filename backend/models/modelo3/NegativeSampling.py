@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from Utils import first_rows
+
+class NegativeSampler:
+    """
+    Drawing unobserved (drug, target) pairs. Drugs and targets are factorized to integer codes and
+    every observed pair becomes the key drug * n_targets + target in a sorted array, so candidates are
+    drawn and checked in vectorized batches (rejection sampling) instead of filtering the DataFrame.
+    :param df: DataFrame with Drug_ID, Drug, Target_ID and Target columns.
+    :param seed: Seed of the sampling (None draws it from numpy's global state, see setup_seed).
+    """
+    def __init__(self, df, seed=None):
+        drug_codes, self.drug_ids = pd.factorize(df['Drug_ID'])
+        target_codes, self.target_ids = pd.factorize(df['Target_ID'])
+        # sequence of each ID, from its first row
+        self.drugs = df['Drug'].to_numpy()[first_rows(drug_codes, len(self.drug_ids))]
+        self.targets = df['Target'].to_numpy()[first_rows(target_codes, len(self.target_ids))]
+        self.n_targets = len(self.target_ids)
+        self.observed = np.unique(drug_codes.astype(np.int64) * self.n_targets + target_codes)
+        self.rng = np.random.default_rng(np.random.randint(2**31) if seed is None else seed)
+
+    @property
+    def capacity(self):
+        """Number of unobserved pairs."""
+        return len(self.drug_ids) * self.n_targets - len(self.observed)
+
+    def sample_keys(self, n, batch_factor=2.0):
+        """
+        n distinct keys of unobserved pairs.
+        :param batch_factor: Oversizing of each batch of candidates to absorb the rejections.
+        """
+        if n > self.capacity:
+            raise ValueError(f"only {self.capacity} unobserved pairs, {n} requested")
+        total = len(self.drug_ids) * self.n_targets
+        accept_rate = self.capacity / total
+        keys = np.empty(0, dtype=np.int64)
+        while len(keys) < n:
+            missing = n - len(keys)
+            candidates = self.rng.integers(0, total, int(missing / accept_rate * batch_factor) + 16)
+            candidates = candidates[~isin_sorted(candidates, self.observed)]
+            # keep the first occurrence of each new key, in draw order
+            keys = np.concatenate((keys, candidates))
+            _, first = np.unique(keys, return_index=True)
+            keys = keys[np.sort(first)][:n]
+        return keys
+
+    def sample(self, n, label, columns=None):
+        """
+        n unobserved pairs as a DataFrame.
+        :param label: Label given to the sampled pairs.
+        :param columns: Column order of the output (default Drug_ID, Drug, Target_ID, Target, Label).
+        """
+        keys = self.sample_keys(n)
+        drug_codes, target_codes = keys // self.n_targets, keys % self.n_targets
+        samples = pd.DataFrame({'Drug_ID': np.asarray(self.drug_ids)[drug_codes],
+                                'Drug': self.drugs[drug_codes],
+                                'Target_ID': np.asarray(self.target_ids)[target_codes],
+                                'Target': self.targets[target_codes],
+                                'Label': label})
+        return samples if columns is None else samples.reindex(columns=columns)
+
+def isin_sorted(values, sorted_keys):
+    """Membership of values in a sorted unique array."""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_keys, values)
+    pos[pos == len(sorted_keys)] = 0
+    return sorted_keys[pos] == values
+
+def oversample_negatives(df, neg_label, pos_label, seed=None):
+    """
+    Balancing a DataFrame with unobserved pairs labelled neg_label. When there are not enough
+    unobserved pairs the existing negatives are repeated instead.
+    """
+    neg_samples = df[df.Label == neg_label]
+    delta = (df.Label == pos_label).sum() - len(neg_samples)
+    if delta <= 0:
+        return df
+    sampler = NegativeSampler(df, seed)
+    if sampler.capacity < delta:
+        logger.info(f'{sampler.capacity} unobserved pairs for {delta} negatives: repeating the negatives')
+        return pd.concat([df] + [neg_samples] * ((df.Label == pos_label).sum() // max(len(neg_samples), 1)), ignore_index=True)
+    logger.info(f'sampling {delta} unobserved pairs as negatives')
+    return pd.concat([df, sampler.sample(delta, neg_label, df.columns)], ignore_index=True)
@@ -0,0 +1,136 @@
+import atexit
+import csv
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+from Utils import CSV_HEADER
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+RECORD_FORMAT = os.environ.get("MODELO3_RECORD_FORMAT", "csv")
+FLUSH_INTERVAL = float(os.environ.get("MODELO3_RECORD_FLUSH_INTERVAL", 10))
+LOG_ARRAYS = os.environ.get("MODELO3_LOG_ARRAYS", "0") == "1"
+
+class Recorder:
+    """
+    Buffered metrics writer. Rows are appended to an in-memory buffer and written by a background
+    thread every flush_interval seconds (or when flush is called, e.g. at the end of an epoch), so
+    the training loop never touches the file. The columns are those of CSV_HEADER present in the
+    first row, in the same order as csv_record.
+    :param path: Output file; its extension is replaced by .parquet in Parquet format.
+    :param fmt: 'csv' or 'parquet' (needs pyarrow, falls back to CSV without it).
+    :param flush_interval: Seconds between background writes.
+    """
+    def __init__(self, path, fmt=RECORD_FORMAT, flush_interval=FLUSH_INTERVAL, header=CSV_HEADER):
+        if fmt == 'parquet' and pq is None:
+            logger.warning("pyarrow is not installed, recording to CSV")
+            fmt = 'csv'
+        self.fmt = fmt
+        self.path = os.path.splitext(path)[0] + '.parquet' if fmt == 'parquet' else path
+        self.flush_interval = flush_interval
+        self.header = header
+        self.columns = None
+        self.rows = []
+        self.writer = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name=f"recorder-{os.path.basename(self.path)}", daemon=True)
+        self.thread.start()
+        # rows still buffered when the process exits are not lost
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, data):
+        """Buffering one row (dict column -> value)."""
+        with self.lock:
+            if self.columns is None:
+                self.columns = [name for name in self.header if name in data]
+            self.rows.append([data.get(name) for name in self.columns])
+
+    def flush(self, wait=False):
+        """Writing the buffered rows, in the background unless wait."""
+        if wait:
+            self.write()
+        else:
+            self.wake.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        # rows recorded while the last background write was running
+        self.write()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        atexit.unregister(self.close)
+
+    def loop(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.write()
+            except Exception as e:
+                logger.error(f"recording to {self.path} failed: {e}")
+            if self.closed:
+                break
+
+    def write(self):
+        with self.io_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return
+            if self.fmt == 'parquet':
+                self.write_parquet(rows)
+            else:
+                self.write_csv(rows)
+
+    def write_csv(self, rows):
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='') as f:
+            write = csv.writer(f)
+            if new:
+                write.writerow(self.columns)
+            write.writerows(rows)
+
+    def write_parquet(self, rows):
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(self.columns)}
+        if self.writer is None:
+            table = pa.table(columns)
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.table(columns, schema=self.writer.schema)
+        self.writer.write_table(table)
+
+def summarize_array(values):
+    """Size, mean, standard deviation, min and max of an array, as a short string."""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if len(values) == 0:
+        return "n=0"
+    return (f"n={len(values)}, mean={values.mean():.4f}, std={values.std():.4f}, "
+            f"min={values.min():.4f}, max={values.max():.4f}")
+
+def log_array(name, values, full=LOG_ARRAYS):
+    """Logging an array as summary statistics, or whole when full (MODELO3_LOG_ARRAYS=1)."""
+    if full:
+        logger.info(f"{name}:{values}")
+    else:
+        logger.info(f"{name}: {summarize_array(values)}")
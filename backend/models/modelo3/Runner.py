@@ -0,0 +1,153 @@
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from loguru import logger
+
+# no model module (nor torch) is imported here: spawned workers import this module before init_worker
+BASE_PATH = os.environ.get("MODELO3_BASE_PATH", "./")
+
+# model name -> (module, entry point); every entry point takes the dataset name, seed_id, base_path
+# and hyperparameters as keyword arguments and returns the test metrics
+MODELS = {"mindg": ("MINDG", "run"),
+          "hoagcn": ("HOAGCN", "train"),
+          "hdn": ("HDN", "train")}
+# models whose drugs/proteins go through the DeepPurpose encodings
+ENCODED_MODELS = {"mindg", "hdn"}
+DATASETS = ["DAVIS", "KIBA", "BindingDB_Kd"]
+
+def expand_grid(models, datasets, seeds, grid=None):
+    """
+    Experiments of a grid: every model x dataset x seed x combination of hyperparameters.
+    :param grid: Dict hyperparameter -> list of values.
+    :return tasks: List of dicts with model, dataset, seed and params.
+    """
+    grid = grid or {}
+    names = sorted(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+    return [{"model": model, "dataset": dataset, "seed": seed, "params": params}
+            for dataset, model, seed, params in itertools.product(datasets, models, seeds, combinations)]
+
+def cache_env(base_path):
+    """Shared cache directories of the runs (graphs, encodings and encoded splits)."""
+    cache_path = os.path.join(base_path, "output", "cache")
+    return {"MODELO3_GRAPH_CACHE": os.path.join(cache_path, "graphs"),
+            "MODELO3_ENCODING_CACHE": os.path.join(cache_path, "encodings"),
+            "MODELO3_DATASET_CACHE": os.path.join(cache_path, "datasets")}
+
+def worker_env(threads, base_path):
+    """
+    Environment of the worker processes: thread caps for torch and the BLAS libraries, the shared
+    caches, and encoding and data loading in-process (no nested pools).
+    """
+    env = {name: str(threads) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")}
+    env.update(cache_env(base_path))
+    env["MODELO3_ENCODE_WORKERS"] = "1"
+    env["MODELO3_NUM_WORKERS"] = "0"
+    return env
+
+def init_worker(env, threads):
+    os.environ.update(env)
+    import torch
+    torch.set_num_threads(threads)
+
+def run_task(task, base_path):
+    """
+    Running one experiment in a worker. Failures are returned in the row, so the rest of the grid goes on.
+    :return row: Dict with the task, its status, the time taken and the test metrics.
+    """
+    row = {"model": task["model"], "dataset": task["dataset"], "seed": task["seed"], **task["params"]}
+    module, entry_point = MODELS[task["model"]]
+    # each run has its own output tree: models and graphs of concurrent runs never collide
+    run_path = os.path.join(base_path, "output", "runs", run_id(task)) + "/"
+    t = time.time()
+    try:
+        fn = getattr(importlib.import_module(module), entry_point)
+        result = fn(task["dataset"], seed_id=task["seed"], base_path=run_path, **task["params"])
+        row["status"] = "ok" if result is not None else "unsupported"
+        row.update(result or {})
+    except Exception as e:
+        logger.error(f"{run_id(task)} failed: {e}\n{traceback.format_exc()}")
+        row["status"] = f"error: {e}"
+    row["seconds"] = time.time() - t
+    row["path"] = run_path
+    return row
+
+def run_id(task):
+    params = "_".join(f"{k}{v}" for k, v in sorted(task["params"].items()))
+    return "_".join(filter(None, [task["model"], task["dataset"], f"seed{task['seed']}", params]))
+
+def prepare(datasets, models, encoding_cache):
+    """
+    Preprocessing shared by the runs, done once in the parent before they start: the datasets are
+    materialized in the DatasetStore (so workers never race on it) and every drug and protein of
+    them is encoded.
+    :param encoding_cache: Directory of the EncodingCache read by the workers.
+    """
+    from DatasetStore import load_dataset
+    from EncodingCache import EncodingCache
+    cache = EncodingCache(encoding_cache)
+    for name in datasets:
+        df = load_dataset(name)
+        if ENCODED_MODELS & set(models):
+            cache.encode(df['Drug'].dropna().unique().tolist(), 'drug', 'MPNN')
+            cache.encode(df['Target'].dropna().unique().tolist(), 'protein', 'CNN')
+        logger.info(f"prepared {name}: {len(df)} pairs")
+
+def run_grid(tasks, processes=1, threads=1, base_path=BASE_PATH, results_path=None):
+    """
+    Running experiments in a process pool and collecting their test metrics in one table.
+    :param processes: Concurrent runs.
+    :param threads: Threads of each run (torch intra-op and BLAS).
+    :param results_path: CSV of the results, rewritten as runs finish (default under base_path/output/).
+    :return results: DataFrame with one row per run.
+    """
+    env = worker_env(threads, base_path)
+    if results_path is None:
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+        results_path = os.path.join(base_path, "output", f"results_{now}.csv")
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    prepare(sorted({t["dataset"] for t in tasks}), {t["model"] for t in tasks}, env["MODELO3_ENCODING_CACHE"])
+
+    rows = []
+    # spawn: every worker is a fresh interpreter that imports torch after its environment is set
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=init_worker, initargs=(env, threads)) as pool:
+        futures = [pool.submit(run_task, task, base_path) for task in tasks]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            pd.DataFrame(rows).to_csv(results_path, index=False)
+            logger.info(f"[{len(rows)}/{len(tasks)}] {row['model']} {row['dataset']} seed {row['seed']}: "
+                        f"{row['status']}, auroc {row.get('auroc', float('nan')):.4f}, {row['seconds']:.0f}s")
+    results = pd.DataFrame(rows).sort_values(["dataset", "model", "seed"], kind="stable", ignore_index=True)
+    results.to_csv(results_path, index=False)
+    logger.info(f"save results ({len(results)} runs) to {results_path}")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Grid of MINDG/HOAGCN/HDN experiments")
+    parser.add_argument("--models", nargs="+", default=["mindg"], choices=sorted(MODELS))
+    parser.add_argument("--datasets", nargs="+", default=DATASETS)
+    parser.add_argument("--seeds", nargs="+", type=int, default=[10])
+    parser.add_argument("--grid", type=json.loads, default={},
+                        help='hyperparameter values as JSON, e.g. \'{"epochs": [5, 10], "learning_rate": [5e-4]}\'')
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None, help="threads per run (default: cores / processes)")
+    parser.add_argument("--base-path", default=BASE_PATH)
+    parser.add_argument("--results", default=None)
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.processes)
+    tasks = expand_grid(args.models, args.datasets, args.seeds, args.grid)
+    logger.info(f"{len(tasks)} runs on {args.processes} processes x {threads} threads")
+    results = run_grid(tasks, args.processes, threads, args.base_path, args.results)
+    print(results.to_string())
@@ -0,0 +1,92 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+class NeighborSampler:
+    """
+    Mini-batch subgraphs for MixHop training: the multi-hop neighbourhood of the batch nodes is
+    extracted from the normalized propagation matrix and propagation runs on that subgraph only.
+    With fanouts=None the full neighbourhood is kept and the batch predictions are exactly the
+    full-graph ones (the propagator keeps the global normalization); with fanouts each node only
+    expands to a random subset of its neighbours, which bounds the subgraph size. Evaluation
+    uses the same subgraphs (see eval_rng), so neither training nor evaluation embeds the whole
+    graph at once; memory is only bounded when fanouts are given.
+    :param propagation_matrix: Normalized propagation matrix (dict with indices and values).
+    :param node_count: Number of nodes of the full graph.
+    :param num_hops: Receptive field of the model, see receptive_field.
+    :param fanouts: Maximum number of neighbours expanded per node at each hop, one per hop (None = all).
+    :param seed: Seed of the neighbour sampling.
+    """
+    def __init__(self, propagation_matrix, node_count, num_hops, fanouts=None, seed=None):
+        if fanouts is not None and len(fanouts) != num_hops:
+            raise ValueError(f"{len(fanouts)} fanouts given for a receptive field of {num_hops} hops")
+        indices = propagation_matrix["indices"].cpu().numpy()
+        values = propagation_matrix["values"].cpu().numpy()
+        self.propagator = sp.csr_matrix((values, (indices[0], indices[1])), shape=(node_count, node_count))
+        self.node_count = node_count
+        self.num_hops = num_hops
+        self.fanouts = fanouts
+        self.rng = np.random.default_rng(seed)
+
+    def eval_rng(self, seed=0):
+        """Generator for the sampling of an evaluation pass, apart from the training stream (same subgraphs every epoch)."""
+        return np.random.default_rng(seed)
+
+    def expand(self, frontier, fanout, rng):
+        """Neighbours of the frontier nodes, at most fanout per node."""
+        indptr = self.propagator.indptr
+        starts = indptr[frontier]
+        degrees = indptr[frontier + 1] - starts
+        owner = np.repeat(np.arange(len(frontier)), degrees)
+        positions = np.arange(degrees.sum()) - np.repeat(np.cumsum(degrees) - degrees, degrees) + np.repeat(starts, degrees)
+        if fanout is not None:
+            # random rank of every edge inside its node, keep the first fanout of each node
+            keys = rng.random(len(positions))
+            order = np.lexsort((keys, owner))
+            rank = np.arange(len(order)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+            positions = positions[order][rank < fanout]
+        return np.unique(self.propagator.indices[positions])
+
+    def sample(self, idx1, idx2, device=torch.device('cpu'), rng=None):
+        """
+        Subgraph of a batch of pairs.
+        :param idx1: Node indices of the drugs of the batch.
+        :param idx2: Node indices of the targets of the batch.
+        :param rng: Generator of the neighbour sampling (default: the training stream of the sampler).
+        :return propagation_matrix: Propagator restricted to the subgraph.
+        :return features: Identity features of the subgraph nodes.
+        :return idx: Pair indices relabelled to the subgraph.
+        """
+        rng = self.rng if rng is None else rng
+        idx1 = np.asarray(idx1)
+        idx2 = np.asarray(idx2)
+        visited = np.zeros(self.node_count, dtype=bool)
+        frontier = np.unique(np.concatenate((idx1, idx2)))
+        visited[frontier] = True
+        for hop in range(self.num_hops):
+            fanout = self.fanouts[hop] if self.fanouts is not None else None
+            neighbours = self.expand(frontier, fanout, rng)
+            frontier = neighbours[~visited[neighbours]]
+            if len(frontier) == 0:
+                break
+            visited[frontier] = True
+        nodes = np.nonzero(visited)[0]
+
+        sub = self.propagator[nodes][:, nodes].tocoo()
+        propagation_matrix = dict()
+        propagation_matrix["indices"] = torch.LongTensor(np.vstack((sub.row, sub.col))).to(device)
+        propagation_matrix["values"] = torch.FloatTensor(sub.data).to(device)
+        features = dict()
+        features["identity"] = True
+        features["dimensions"] = (len(nodes), self.node_count)
+        features["node_ids"] = torch.LongTensor(nodes).to(device)
+        idx = (torch.LongTensor(np.searchsorted(nodes, idx1)).to(device),
+               torch.LongTensor(np.searchsorted(nodes, idx2)).to(device))
+        return propagation_matrix, features, idx
+
+def receptive_field(model):
+    """
+    Number of hops that reach a node's latent features in a MixHopNetwork:
+    the highest adjacency power of the upper plus the bottom layers.
+    """
+    return (model.order_1 - 1) + (model.order_2 - 1)
@@ -1,4 +1,5 @@
 import csv
+import json
 import os
 import random
 
@@ -9,57 +10,27 @@ import numpy as np
 
 from loguru import logger
 
+from GraphBuilder import load_propagator
+from Metrics import confusion_counts, confusion_metrics
+
 neg_label = 1
 pos_label = 0
 
+# root of the output/ tree (models, graphs, logs and metrics of every run)
+BASE_PATH = os.environ.get("MODELO3_BASE_PATH", "./")
+
 def class_metrics(y_label, y_pred):
-    logger.info(f'y_label:{y_label}')
-    logger.info(f'y_pred:{y_pred}')
-    TP = 0
-    FP = 0
-    TN = 0
-    FN = 0
-    total = len(y_label)
-    for i in range(total):
-        if y_pred[i] == pos_label and y_label[i] == pos_label:
-            TP = TP + 1
-        elif y_pred[i] == pos_label and y_label[i] == neg_label:
-            FP = FP + 1
-        elif y_pred[i] == neg_label and y_label[i] == neg_label:
-            TN = TN + 1
-        elif  y_pred[i] == neg_label and y_label[i] == pos_label:
-            FN = FN + 1
-        else:
-            print(f"error,y_pred:{y_pred[i]},y_label:{y_label[i]}")
+    TP, TN, FP, FN = confusion_counts(y_label, y_pred, pos_label, neg_label)
     logger.info(f"TP:{TP},TN:{TN},FP:{FP},FN:{FN}")
-    if (TP + FN) == 0:
-        sensitivity= 1.0
-    else:
-        sensitivity  = TP / (TP + FN)
-    if (FP + TN) == 0:
-        specificity = 1.0
-    else:
-        specificity = TN / (FP + TN)
-    recall = sensitivity
-    if (TP + FP) == 0:
-        precision = 1.0
-    else:
-        precision = TP / (TP + FP)
-    accuracy = (TP + TN) / (TP + TN + FP + FN)
-    if (2*TP + FN + FP) == 0:
-        f1 = 1.0
-    else:
-        f1 = 2*TP /(2*TP + FN + FP)
-    return {"sensitivity":sensitivity, "specificity":specificity,
-            "recall":recall, "precision":precision, "accuracy":accuracy, 
-            "f1":f1}
+    return confusion_metrics(TP, TN, FP, FN)
+
+CSV_HEADER = ['epoch','batch','lr','loss','avg_loss','epoch_loss','auprc', 'auroc', 'sensitivity', 'specificity',
+              'recall','precision','cindex','accuracy','f1','samples_per_sec']
 
 def csv_record(path, data):
-    all_header = ['epoch','batch','lr','loss','avg_loss','epoch_loss','auprc', 'auroc', 'sensitivity', 'specificity',
-              'recall','precision','cindex','accuracy','f1']  
     row = []
     header = []
-    for name in all_header:
+    for name in CSV_HEADER:
         if name in data.keys():
             row.append(data[name])
             header.append(name)
@@ -82,14 +53,18 @@ def check_dir(path):
         logger.info(f"dir exists, {path}")
         
 def save_model(model, path):
-    torch.save(model.state_dict(),path)
+    # written aside and renamed: a crash never leaves a truncated model file
+    tmp = f"{path}.tmp{os.getpid()}"
+    torch.save(model.state_dict(), tmp)
+    os.replace(tmp, path)
     logger.info(f"save {path} model parameters done")
 
 def load_model(model, path):
-    if os.path.exists(path):
-        model.load_state_dict(torch.load(path))
-        model.eval()
-        logger.info(f"load {path} model parameters done")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"no model parameters at {path}")
+    model.load_state_dict(torch.load(path, map_location='cpu'))
+    model.eval()
+    logger.info(f"load {path} model parameters done")
         
 def normalize_adjacency_matrix(A, I):
     """
@@ -120,6 +95,18 @@ def create_propagator_matrix(A, device):
     propagator["values"] = torch.FloatTensor(A_tilde_hat.data).to(device)
     return propagator
 
+def identity_features(node_count, device):
+    """
+    Featureless graph: implicit identity feature matrix. Multiplying by it is a row lookup of the
+    weight matrix, so nothing of size node_count x node_count is materialized.
+    :param node_count: Number of nodes.
+    :return out_features: Dict flagged as identity, with the dimensions of the implicit matrix.
+    """
+    out_features = dict()
+    out_features["identity"] = True
+    out_features["dimensions"] = (node_count, node_count)
+    return out_features
+
 def features_to_sparse(features, device):
     """
     Reading the feature matrix stored as JSON from the disk.
@@ -140,6 +127,50 @@ def features_to_sparse(features, device):
     out_features["dimensions"] = features.shape
     return out_features
 
+def save_graph(path, idx, n_drugs, edges, drugs, targets):
+    """
+    Saving the drug-target graph a model was trained on, so that it can be served later.
+    :param path: Output directory.
+    :param idx: Node IDs, drugs first and then targets; the position is the node index.
+    :param n_drugs: Number of drug nodes.
+    :param edges: Array [E, 2] of node indices.
+    :param drugs: Dict SMILES -> Drug_ID.
+    :param targets: Dict sequence -> Target_ID.
+    """
+    check_dir(path)
+    with open(os.path.join(path, "nodes.json"), "w") as f:
+        json.dump({"nodes": [str(i) for i in idx], "n_drugs": int(n_drugs)}, f)
+    with open(os.path.join(path, "entities.json"), "w") as f:
+        json.dump({"drugs": {str(k): str(v) for k, v in drugs.items()},
+                   "targets": {str(k): str(v) for k, v in targets.items()}}, f)
+    np.save(os.path.join(path, "edges.npy"), np.asarray(edges, dtype=np.int64))
+    logger.info(f"save graph ({len(idx)} nodes, {len(edges)} edges) to {path}")
+
+def load_graph(path):
+    """
+    Loading a graph written by save_graph.
+    :return graph: Dict with idx, idx_map, n_drugs, edges, drugs, targets and csr (the memory-mapped
+                  propagator written by GraphBuilder.save_propagator, None if there is none).
+    """
+    with open(os.path.join(path, "nodes.json")) as f:
+        nodes = json.load(f)
+    with open(os.path.join(path, "entities.json")) as f:
+        entities = json.load(f)
+    idx = nodes["nodes"]
+    return {"idx": idx,
+            "csr": load_propagator(path),
+            "idx_map": {j: i for i, j in enumerate(idx)},
+            "n_drugs": nodes["n_drugs"],
+            "edges": np.load(os.path.join(path, "edges.npy")),
+            "drugs": entities["drugs"],
+            "targets": entities["targets"]}
+
+def first_rows(codes, n):
+    """Position of the first occurrence of each code 0..n-1."""
+    first = np.full(n, len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    return first
+
 def setup_seed(seed):
     # https://zhuanlan.zhihu.com/p/462570775
     # torch.use_deterministic_algorithms(True) # 检查pytorch中有哪些不确定性
@@ -0,0 +1,144 @@
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import time
+
+import torch
+
+from serving import MINDGService, NotInGraphError, GRAPH_DIR, CHECKPOINT
+
+service: MINDGService = None
+model_load_failed = False
+
+
+class PredictionRequest(BaseModel):
+    protein_sequence: str
+    ligand_smiles: str
+
+
+class BatchPredictionRequest(BaseModel):
+    data: List[PredictionRequest]
+
+
+class RankRequest(BaseModel):
+    ligand_smiles: Optional[str] = None
+    protein_sequence: Optional[str] = None
+    k: int = 10
+    fused: bool = False
+
+
+class Interaction(BaseModel):
+    protein_sequence: str
+    ligand_smiles: str
+    drug_id: Optional[str] = None
+    target_id: Optional[str] = None
+
+
+class GraphUpdateRequest(BaseModel):
+    interactions: List[Interaction]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Carga MINDG y precalcula los embeddings de nodos de HOAGCN una sola vez."""
+    global service, model_load_failed
+    start_time = time.time()
+
+    try:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        service = MINDGService(GRAPH_DIR, CHECKPOINT, device)
+    except Exception as e:
+        print(f"Error CRÍTICO al inicializar el modelo3 después de {time.time() - start_time:.2f} segundos: {e}")
+        model_load_failed = True
+    yield
+    service = None
+
+app = FastAPI(
+    lifespan=lifespan,
+    title="Modelo3 Prediction API",
+    description="API para predicción de interacción fármaco-diana usando MINDG (HDN + HOAGCN)."
+)
+
+
+def check_model():
+    if service is None or model_load_failed:
+        raise HTTPException(status_code=503, detail="Servicio no disponible. El modelo3 no se cargó correctamente al inicio.")
+
+
+@app.get("/health", status_code=200)
+async def health():
+    return {"status": "ok", "model_loaded": service is not None, "model_load_failed": model_load_failed}
+
+
+@app.post("/get_prediction", status_code=200)
+def get_prediction(data: PredictionRequest):
+    """
+    Predicción para un par proteína-ligando. Si el fármaco o la diana no están en el grafo
+    sólo se usa la vista de secuencia (HDN).
+    Los endpoints de inferencia son síncronos: FastAPI los ejecuta en su pool de hilos y el
+    event loop sigue atendiendo otras peticiones.
+    """
+    check_model()
+    try:
+        return {"result": service.predict([data.ligand_smiles], [data.protein_sequence])[0]}
+    except Exception as e:
+        print(f"Error interno durante la predicción: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al procesar la predicción: {str(e)}")
+
+
+@app.post("/get_predictions", status_code=200)
+def get_predictions(data: BatchPredictionRequest):
+    """Predicción por lotes, en el mismo orden que la entrada."""
+    check_model()
+    if not data.data:
+        raise HTTPException(status_code=400, detail="No data provided")
+    try:
+        return {"results": service.predict([pair.ligand_smiles for pair in data.data],
+                                           [pair.protein_sequence for pair in data.data])}
+    except Exception as e:
+        print(f"Error interno durante la predicción por lotes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al procesar la predicción: {str(e)}")
+
+
+@app.post("/rank", status_code=200)
+def rank(data: RankRequest):
+    """
+    Top-k de dianas para un ligando (o de ligandos para una diana), puntuando toda la fila o
+    columna de la matriz de interacción sobre los embeddings de nodos precalculados.
+    Con fused=True se combina con la vista de secuencia (HDN) igual que en MINDG.
+    """
+    check_model()
+    if (data.ligand_smiles is None) == (data.protein_sequence is None):
+        raise HTTPException(status_code=400, detail="Indica ligand_smiles o protein_sequence (sólo uno)")
+    if data.k < 1:
+        raise HTTPException(status_code=400, detail="k debe ser mayor que 0")
+    query_is_drug = data.ligand_smiles is not None
+    try:
+        results = service.rank(data.ligand_smiles if query_is_drug else data.protein_sequence,
+                               query_is_drug, data.k, data.fused)
+    except NotInGraphError as e:
+        raise HTTPException(status_code=404, detail=f"No está en el grafo: {str(e)}")
+    except Exception as e:
+        print(f"Error interno durante el ranking: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al procesar el ranking: {str(e)}")
+    return {"results": results}
+
+
+@app.post("/add_interactions", status_code=200)
+def add_interactions(data: GraphUpdateRequest):
+    """
+    Añade interacciones conocidas al grafo sin reconstruirlo: sólo se renormalizan las
+    entradas afectadas y se recalculan los embeddings de nodos de la región cambiada.
+    La actualización toma el lock del servicio, así que las predicciones concurrentes ven el
+    grafo anterior o el nuevo, nunca uno a medias.
+    """
+    check_model()
+    if not data.interactions:
+        raise HTTPException(status_code=400, detail="No data provided")
+    try:
+        return {"result": service.add_interactions([(i.ligand_smiles, i.protein_sequence, i.drug_id, i.target_id)
+                                                    for i in data.interactions])}
+    except Exception as e:
+        print(f"Error interno durante la actualización del grafo: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al actualizar el grafo: {str(e)}")
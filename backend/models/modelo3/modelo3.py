@@ -8,7 +8,8 @@ import os
 # They are currently STUBS and must be replaced with your real model code.
 from MINDG import MINDG
 from HDN import get_model
-from HOAGCN import MixHopNetwork, create_propagator_matrix, features_to_sparse
+from HOAGCN import MixHopNetwork, create_propagator_matrix
+from Utils import identity_features
 
 # --- Import Preprocessing ---
 # You need to have DeepPurpose installed: pip install DeepPurpose
@@ -114,8 +115,8 @@ A = sp.eye(feature_number, format="csr")
 
 # NOTE: This uses the STUB function from HOAGCN.py
 propagation_matrix = create_propagator_matrix(A, device)
-# NOTE: This uses the STUB function from HOAGCN.py
-features = features_to_sparse(np.eye(feature_number), device)
+# Implicit identity features (no dense np.eye is materialized)
+features = identity_features(feature_number, device)
 
 # -----------------------------
 # 6. Combine into MINDG
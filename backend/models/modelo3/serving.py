@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from loguru import logger
+
+from DeepPurpose import utils
+
+from MINDG import MINDG, neg_label, pos_label
+from HDN import get_model
+from HOAGCN import MixHopNetwork
+from Utils import load_graph, identity_features
+from GraphBuilder import normalized_adjacency
+from IncrementalGraph import IncrementalGraph
+from Subgraph import receptive_field
+
+GRAPH_DIR = os.environ.get("MODELO3_GRAPH_DIR", "output/model/graph_DAVIS/")
+CHECKPOINT = os.environ.get("MODELO3_CHECKPOINT", "output/model/mindg_DAVIS_epoch5.pt")
+
+class NotInGraphError(LookupError):
+    """The query of a graph-view ranking is not a node of the interaction graph."""
+
+def encode_pairs(drugs, targets):
+    """
+    Encoding drug SMILES (MPNN) and protein sequences (CNN) the same way as the training data.
+    :return v_d, v_p: Collated HDN inputs.
+    """
+    df = pd.DataFrame({'Seq_Drug': drugs, 'Seq_Target': targets})
+    df = utils.encode_drug(df, 'MPNN', column_name='Seq_Drug')
+    df = utils.encode_protein(df, 'CNN', column_name='Seq_Target')
+    batch = [(d, utils.protein_2_embed(t), 0) for d, t in zip(df.drug_encoding, df.target_encoding)]
+    v_d, v_p, _ = utils.mpnn_collate_func(batch)
+    return v_d, v_p
+
+class MINDGService:
+    """
+    MINDG at inference time: the HOAGCN latent node features are computed once when the
+    service starts, so a request only pays for row lookups, the bilinear/decoder head and HDN.
+    The graph state (entity maps, node indices, latent features) is read and updated under one
+    lock, so predictions running in the threadpool never see a half-applied graph update.
+    :param graph_dir: Directory written by Utils.save_graph during training.
+    :param checkpoint: MINDG state dict written by Utils.save_model.
+    :param device: Torch device.
+    """
+    def __init__(self, graph_dir=GRAPH_DIR, checkpoint=CHECKPOINT, device=torch.device('cpu')):
+        t = time.time()
+        self.device = device
+        self.lock = threading.Lock()
+        graph = load_graph(graph_dir)
+        self.idx = graph["idx"]
+        self.idx_map = graph["idx_map"]
+        self.n_drugs = graph["n_drugs"]
+        self.edges = graph["edges"]
+        self.drugs = graph["drugs"]
+        self.targets = graph["targets"]
+        node_count = len(self.idx)
+
+        # propagator persisted at training time; graphs saved without it are normalized here
+        csr = graph["csr"] if graph["csr"] is not None else normalized_adjacency(self.edges, node_count)
+        self.graph = IncrementalGraph(self.idx, *csr)
+        propagation_matrix = self.graph.propagator(device)
+        features = identity_features(node_count, device)
+
+        hdn_model = get_model().model
+        hoagcn_model = MixHopNetwork(node_count, device=device)
+        self.model = MINDG(hdn_model, hoagcn_model, propagation_matrix, features).to(device)
+        state_dict = torch.load(checkpoint, map_location=device)
+        state_dict = state_dict["state_dict"] if "state_dict" in state_dict else state_dict
+        self.model.load_state_dict(state_dict)
+        self.model.eval()
+
+        with torch.no_grad():
+            self.latent_features = self.model.embed()
+        logger.info(f"MINDG service ready: {node_count} nodes, {len(self.edges)} edges, {time.time() - t:.2f}s")
+
+    @torch.no_grad()
+    def add_interactions(self, interactions):
+        """
+        Adding known interactions to the graph without rebuilding it: the propagator is
+        renormalized only around the changed nodes and only the latent features within the
+        receptive field of the changes are recomputed. Unknown drugs and targets become new
+        nodes (they have no trained identity row, so their own input features are zero).
+        :param interactions: Iterable of (smiles, sequence, drug_id, target_id); a missing ID
+                             defaults to the SMILES or the sequence.
+        :return summary: Dict with the number of new nodes, changed nodes and total nodes.
+        """
+        t = time.time()
+        with self.lock:
+            pairs = []
+            for smiles, sequence, drug_id, target_id in interactions:
+                drug_id = self.drugs.setdefault(smiles, drug_id or smiles)
+                target_id = self.targets.setdefault(sequence, target_id or sequence)
+                pairs.append((drug_id, target_id))
+            new = self.graph.add_nodes([node for pair in pairs for node in pair])
+            changed = self.graph.add_edges(pairs)
+            self.idx = self.graph.idx
+            self.idx_map = self.graph.idx_map
+
+            self.model.propagation_matrix = self.graph.propagator(self.device)
+            self.model.features = identity_features(len(self.graph), self.device)
+            self.latent_features = self.graph.refresh_embeddings(self.model.view2_model, self.latent_features,
+                                                                 set(new) | set(changed),
+                                                                 receptive_field(self.model.view2_model),
+                                                                 self.device)
+            nodes = len(self.graph)
+        logger.info(f"graph update: {len(new)} new nodes, {len(changed)} changed nodes, {time.time() - t:.2f}s")
+        return {"new_nodes": len(new), "changed_nodes": len(changed), "nodes": nodes}
+
+    @torch.no_grad()
+    def rank(self, query, query_is_drug=True, k=10, fused=False, chunk_size=4096):
+        """
+        Ranking every target for a drug (or every drug for a target) in chunked tensor ops.
+        Candidates are ordered by the probability of pos_label (binding, Kd <= 30), i.e. by
+        increasing logit. The graph view needs the query to be a node of the graph; with
+        fused=True the logits are the alpha blend with HDN, which is run on every candidate.
+        :param query: Drug SMILES or protein sequence.
+        :param query_is_drug: True when query is a SMILES and the candidates are the targets.
+        :param k: Number of partners returned.
+        :return results: The k best partners with their ID, SMILES/sequence, logit, probability and label.
+        :raises NotInGraphError: The query is not a node of the graph and fused is False.
+        """
+        with self.lock:
+            entities = self.targets if query_is_drug else self.drugs
+            query_id = (self.drugs if query_is_drug else self.targets).get(query)
+            query_node = self.idx_map.get(query_id)
+            partners = [(entity, node_id) for entity, node_id in entities.items() if node_id in self.idx_map]
+            if query_node is None and not fused:
+                raise NotInGraphError("query is not a node of the graph, use fused=True to rank with the sequence view only")
+            if not partners:
+                return []
+
+            output = torch.zeros(len(partners), device=self.device)
+            if query_node is not None:
+                candidates = torch.tensor([self.idx_map[node_id] for _, node_id in partners], device=self.device)
+                output = self.model.view2_model.score_all(self.latent_features, query_node, candidates,
+                                                          query_first=query_is_drug, chunk_size=chunk_size)
+        # the sequence view does not read the graph: HDN runs outside the lock
+        if fused:
+            hdn = []
+            for start in range(0, len(partners), chunk_size):
+                chunk = [entity for entity, _ in partners[start:start + chunk_size]]
+                drugs, targets = ([query] * len(chunk), chunk) if query_is_drug else (chunk, [query] * len(chunk))
+                v_d, v_p = encode_pairs(drugs, targets)
+                hdn.append(self.model.view1_model(v_d, v_p).flatten())
+            hdn = torch.cat(hdn)
+            output = hdn if query_node is None else self.model.alpha * hdn + (1 - self.model.alpha) * output
+
+        top = torch.topk(output, min(k, len(partners)), largest=False)
+        prob = torch.sigmoid(top.values)
+        return [{"id": partners[i][1],
+                 "entity": partners[i][0],
+                 "logit": float(o),
+                 "probability": float(p),
+                 "label": neg_label if p > 0.5 else pos_label,
+                 "graph_view": query_node is not None}
+                for i, o, p in zip(top.indices.tolist(), top.values, prob)]
+
+    def node_pair(self, smiles, sequence):
+        """Graph node indices of a (drug, target) pair, None when either is not in the graph (call under lock)."""
+        idx1 = self.idx_map.get(self.drugs.get(smiles))
+        idx2 = self.idx_map.get(self.targets.get(sequence))
+        if idx1 is None or idx2 is None:
+            return None
+        return idx1, idx2
+
+    @torch.no_grad()
+    def predict(self, drugs, targets):
+        """
+        Scoring (drug SMILES, protein sequence) pairs. Pairs whose drug or target is not a node
+        of the graph are scored with the sequence view (HDN) only.
+        :return results: One dict per pair with the logit, the probability of label 1 and the predicted label.
+        """
+        v_d, v_p = encode_pairs(drugs, targets)
+        output = self.model.view1_model(v_d, v_p).flatten()
+
+        with self.lock:
+            pairs = [self.node_pair(d, t) for d, t in zip(drugs, targets)]
+            rows = [i for i, p in enumerate(pairs) if p is not None]
+            if rows:
+                idx1 = torch.tensor([pairs[i][0] for i in rows], device=self.device)
+                idx2 = torch.tensor([pairs[i][1] for i in rows], device=self.device)
+                graph_pred = self.model.view2_model.score(self.latent_features, (idx1, idx2)).flatten()
+        if rows:
+            rows_t = torch.tensor(rows, device=self.device)
+            alpha = self.model.alpha
+            output[rows_t] = alpha * output[rows_t] + (1 - alpha) * graph_pred
+
+        prob = torch.sigmoid(output)
+        return [{"logit": float(o),
+                 "probability": float(p),
+                 "label": neg_label if p > 0.5 else pos_label,
+                 "graph_view": pair is not None}
+                for o, p, pair in zip(output, prob, pairs)]